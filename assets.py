@@ -0,0 +1,150 @@
+import gzip
+from hashlib import sha256
+from threading import Lock
+from urllib.parse import parse_qs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+REVALIDATE = "no-cache"
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def content_version(body):
+    return sha256(body).hexdigest()[:12]
+
+
+def accepted_encodings(header):
+    encodings = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        params = params.replace(" ", "")
+        if coding and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            encodings.add(coding.lower())
+    return encodings
+
+
+def buffer_response(app, environ):
+    response = []
+    written = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return written.append
+
+    result = app(environ, start_response)
+    try:
+        written.extend(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    status, headers = response
+    return status, headers, b"".join(written)
+
+
+def etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+class Asset:
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = [
+            (name, value) for name, value in headers
+            if name.lower() not in ("content-length", "content-encoding", "etag", "cache-control")
+        ]
+        digest = sha256(body).hexdigest()[:32]
+        self.version = content_version(body)
+        self.encodings = {None: (body, f'"{digest}"')}
+        self.encodings["gzip"] = (gzip.compress(body, 9, mtime=0), f'"{digest}-gzip"')
+        if brotli is not None:
+            self.encodings["br"] = (brotli.compress(body), f'"{digest}-br"')
+
+    def choose(self, accept_encoding):
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encodings:
+                return encoding
+        return None
+
+
+class AssetCache:
+
+    def __init__(self, app, paths, version=lambda: None):
+        self.app = app
+        self.paths = paths
+        self.version = version
+        self.assets = {}
+        self.lock = Lock()
+
+    def render(self, environ):
+        return Asset(*buffer_response(self.app, dict(environ, QUERY_STRING="", REQUEST_METHOD="GET")))
+
+    def asset(self, environ, path):
+        version = self.version()
+        cached = self.assets.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self.lock:
+            cached = self.assets.get(path)
+            if cached is None or cached[0] != version:
+                cached = (version, self.render(environ))
+                self.assets[path] = cached
+        return cached[1]
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        key = self.paths.get(path)
+        if key is None or environ.get("REQUEST_METHOD") not in ("GET", "HEAD"):
+            return self.app(environ, start_response)
+        asset = self.asset(environ, key)
+        if not asset.status.startswith("200"):
+            return self.app(environ, start_response)
+        encoding = asset.choose(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        body, etag = asset.encodings[encoding]
+        versioned = key != "index" and parse_qs(environ.get("QUERY_STRING", "")).get("v") == [asset.version]
+        headers = [
+            ("ETag", etag),
+            ("Cache-Control", IMMUTABLE if versioned else REVALIDATE),
+            ("Vary", "Accept-Encoding"),
+        ]
+        if etag_matches(environ.get("HTTP_IF_NONE_MATCH", ""), etag):
+            start_response("304 Not Modified", headers)
+            return [b""]
+        headers.extend(asset.headers)
+        if encoding is not None:
+            headers.append(("Content-Encoding", encoding))
+        headers.append(("Content-Length", str(len(body))))
+        start_response(asset.status, headers)
+        return [b"" if environ["REQUEST_METHOD"] == "HEAD" else body]
+
+
+class CompressionMiddleware:
+
+    def __init__(self, app, paths, min_size=1024, level=6):
+        self.app = app
+        self.paths = paths
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO", "") not in self.paths:
+            return self.app(environ, start_response)
+        if "gzip" not in accepted_encodings(environ.get("HTTP_ACCEPT_ENCODING", "")):
+            return self.app(environ, start_response)
+        status, headers, body = buffer_response(self.app, environ)
+        headers = [(name, value) for name, value in headers if name.lower() != "content-length"]
+        if len(body) >= self.min_size and not any(name.lower() == "content-encoding" for name, value in headers):
+            body = gzip.compress(body, self.level, mtime=0)
+            headers.append(("Content-Encoding", "gzip"))
+        headers.append(("Vary", "Accept-Encoding"))
+        headers.append(("Content-Length", str(len(body))))
+        start_response(status, headers)
+        return [body]
@@ -0,0 +1,313 @@
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import json
+import os
+import random
+import string
+from tempfile import TemporaryDirectory
+from threading import Thread
+from time import perf_counter
+import tracemalloc
+from urllib.parse import quote, urlencode
+from wsgiref.util import setup_testing_defaults
+
+from assets import buffer_response
+from catalog import Catalog, SORTABLE_FIELDS
+from csv_to_json import write_json
+from data_dir import load_data
+from main import MusicController, get_args as get_app_args, wsgi
+from preview import PreviewResolver
+
+WORDS = (
+    "love", "night", "dance", "fire", "blue", "moon", "heart", "city",
+    "summer", "dream", "light", "girl", "baby", "time", "home", "wild",
+    "Beyoncé", "Sigur Rós", "Motörhead", "Straße", "Ça plane", "Mañana",
+)
+
+
+def synthetic_data(count, seed=0):
+    rnd = random.Random(seed)
+    artists = [" ".join(rnd.choices(WORDS, k=rnd.randint(1, 2))).title() for _ in range(max(count // 20, 1))]
+    albums = [" ".join(rnd.choices(WORDS, k=rnd.randint(1, 3))) for _ in range(max(count // 10, 1))]
+    data = {}
+    for number in range(count):
+        track_id = "".join(rnd.choices(string.ascii_letters + string.digits, k=22))
+        row = {
+            "#": number + 1,
+            "song": " ".join(rnd.choices(WORDS, k=rnd.randint(1, 4))).capitalize(),
+            "artist": rnd.choice(artists),
+            "album": rnd.choice(albums),
+            "album_date": f"{rnd.randint(1960, 2024)}-01-01",
+            "time": f"{rnd.randint(1, 9)}:{rnd.randint(0, 59):02d}",
+            "spotify_track_id": track_id,
+            "genres": "pop",
+        }
+        for field in SORTABLE_FIELDS:
+            if field == "tempo":
+                row[field] = rnd.randint(60, 200)
+            elif field != "time":
+                row[field] = rnd.randint(0, 100)
+        data[track_id] = row
+    return data
+
+
+def workload(data, count, seed=0):
+    rnd = random.Random(seed)
+    songs = list(data.values())
+    requests = []
+    for _ in range(count):
+        form = {"page": str(rnd.choice((1, 1, 1, 2, 2, 3, 5, 10, 50))), "search": ""}
+        kind = rnd.random()
+        if kind < 0.3:
+            form["search"] = rnd.choice(WORDS)[:rnd.randint(2, 6)]
+        elif kind < 0.5:
+            form["search"] = rnd.choice(songs)[rnd.choice(("song", "artist", "album"))].lower()
+        for field in SORTABLE_FIELDS:
+            form[field] = "0"
+        for field in rnd.sample(SORTABLE_FIELDS, rnd.choice((0, 0, 1, 1, 2, 3))):
+            form[field] = rnd.choice(("-1", "1"))
+        requests.append(form)
+    return requests
+
+
+class FormRequest:
+
+    def __init__(self, form):
+        self.POST = form
+
+
+def latency_stats(samples):
+    samples = sorted(samples)
+    total = sum(samples)
+
+    def percentile(fraction):
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+    return {
+        "requests": len(samples),
+        "requests_per_second": len(samples) / total if total else 0.0,
+        "mean_seconds": total / len(samples),
+        "p50_seconds": percentile(0.5),
+        "p95_seconds": percentile(0.95),
+        "p99_seconds": percentile(0.99),
+        "max_seconds": samples[-1],
+    }
+
+
+def bench_controller_json(controller, requests):
+    samples = []
+    for form in requests:
+        start = perf_counter()
+        controller.json(FormRequest(form))
+        samples.append(perf_counter() - start)
+    return latency_stats(samples)
+
+
+def call_wsgi(app, method, path, query="", body=b""):
+    environ = {
+        "REQUEST_METHOD": method,
+        "PATH_INFO": path,
+        "QUERY_STRING": query,
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "CONTENT_LENGTH": str(len(body)),
+        "HTTP_ACCEPT_ENCODING": "gzip",
+        "wsgi.input": BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    status, _, body = buffer_response(app, environ)
+    if not status.startswith("200"):
+        raise RuntimeError(f"{method} {path}: {status}")
+    return len(body)
+
+
+def bench_wsgi_json(app, requests):
+    samples = []
+    size = 0
+    for form in requests:
+        body = urlencode(form).encode()
+        start = perf_counter()
+        size += call_wsgi(app, "POST", "/json", body=body)
+        samples.append(perf_counter() - start)
+    stats = latency_stats(samples)
+    stats["bytes_per_response"] = size / len(requests)
+    return stats
+
+
+def write_data_dir(data, data_dir):
+    write_json(data.values(), os.path.join(data_dir, "songs.json"))
+    catalog_dir = os.path.join(data_dir, "catalog")
+    os.mkdir(catalog_dir)
+    Catalog(data.values()).save(os.path.join(catalog_dir, "songs.catalog"))
+    return {"json": data_dir, "catalog": catalog_dir}
+
+
+def bench_startup(data_dir, previews):
+    stats = {}
+    start = perf_counter()
+    data = load_data(data_dir, stats)
+    loaded = perf_counter()
+    controller = MusicController(data, previews=previews)
+    ready = perf_counter()
+    del data
+    tracemalloc.start()
+    try:
+        traced_data = load_data(data_dir)
+        data_bytes, _ = tracemalloc.get_traced_memory()
+        traced = MusicController(traced_data, previews=previews)
+        del traced_data
+        current, peak = tracemalloc.get_traced_memory()
+        del traced
+    finally:
+        tracemalloc.stop()
+    results = {
+        "load_data_seconds": loaded - start,
+        "controller_seconds": ready - loaded,
+        "rows": stats["rows"],
+        "duplicates": stats["duplicates"],
+        "data_bytes": data_bytes,
+        "retained_bytes": current,
+        "peak_bytes": peak,
+    }
+    return controller, results
+
+
+class StubEmbedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        track_id = self.path.rsplit("/", 1)[-1]
+        resource = quote(json.dumps({"name": track_id, "preview_url": f"https://p.scdn.co/mp3-preview/{track_id}"}))
+        body = (
+            "<html><body>" + "<div></div>" * 500
+            + f'<script id="resource" type="application/json">{resource}</script>'
+            + "<div></div>" * 500 + "</body></html>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubEmbedHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def bench_previews(app, track_ids):
+    cold = []
+    for track_id in track_ids:
+        start = perf_counter()
+        call_wsgi(app, "GET", "/preview_url", query=urlencode({"track_id": track_id}))
+        cold.append(perf_counter() - start)
+    warm = []
+    for track_id in track_ids:
+        start = perf_counter()
+        call_wsgi(app, "GET", "/preview_url", query=urlencode({"track_id": track_id}))
+        warm.append(perf_counter() - start)
+    return {"cold": latency_stats(cold), "warm": latency_stats(warm)}
+
+
+def timed(func, repeat):
+    start = perf_counter()
+    for _ in range(repeat):
+        func()
+    return (perf_counter() - start) / repeat
+
+
+def bench_page_encoding(data, catalog, songs_per_page, repeat):
+    rows = list(data.values())
+    pages = [
+        catalog.default_order[start:start + songs_per_page]
+        for start in range(0, min(catalog.size, 100 * songs_per_page), songs_per_page)
+    ]
+
+    def dict_path():
+        for page, indices in enumerate(pages, 1):
+            songs = [rows[index] for index in indices]
+            json.dumps({"songs": songs, "page": page, "max_page": len(pages)}).encode()
+
+    def fragment_path():
+        for page, indices in enumerate(pages, 1):
+            catalog.page_json(indices, page, len(pages))
+
+    dict_bytes = sum(
+        len(json.dumps({"songs": [rows[index] for index in indices], "page": page, "max_page": len(pages)}))
+        for page, indices in enumerate(pages, 1)
+    )
+    fragment_bytes = sum(len(catalog.page_json(indices, page, len(pages))) for page, indices in enumerate(pages, 1))
+    return {
+        "pages": len(pages),
+        "dict_seconds_per_page": timed(dict_path, repeat) / len(pages),
+        "fragment_seconds_per_page": timed(fragment_path, repeat) / len(pages),
+        "dict_bytes_per_page": dict_bytes / len(pages),
+        "fragment_bytes_per_page": fragment_bytes / len(pages),
+    }
+
+
+def bench_size(count, options, base_url):
+    data = synthetic_data(count)
+    results = {"songs": count}
+    with TemporaryDirectory() as data_dir:
+        paths = write_data_dir(data, data_dir)
+        previews = PreviewResolver(base_url=base_url)
+        try:
+            startup = {}
+            for name, path in paths.items():
+                controller, startup[name] = bench_startup(path, previews)
+            results["startup"] = startup
+            controller.songs_per_page = options.songs_per_page
+            requests = workload(data, options.requests)
+            results["controller_json"] = bench_controller_json(controller, requests)
+            app = wsgi(get_app_args(), controller)
+            results["wsgi_json"] = bench_wsgi_json(app, requests)
+            track_ids = random.Random(1).sample(list(data), min(options.previews, count))
+            results["preview_url"] = bench_previews(app, track_ids)
+        finally:
+            previews.close()
+    results["page_encoding"] = bench_page_encoding(
+        data, Catalog(data.values()), options.songs_per_page, options.repeat
+    )
+    return results
+
+
+def get_args():
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", default="1000,100000,1000000", required=False)
+    parser.add_argument("--songs-per-page", default=20, type=int, required=False)
+    parser.add_argument("--requests", default=500, type=int, required=False)
+    parser.add_argument("--previews", default=50, type=int, required=False)
+    parser.add_argument("--repeat", default=20, type=int, required=False)
+    parser.add_argument("--output", default=None, required=False)
+    args, _ = parser.parse_known_args()
+    return args
+
+
+def main():
+    options = get_args()
+    server, base_url = start_stub_server()
+    try:
+        results = {
+            "benchmarks": [
+                bench_size(int(count), options, base_url)
+                for count in options.sizes.split(",")
+            ],
+        }
+    finally:
+        server.shutdown()
+    output = json.dumps(results, indent=4)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
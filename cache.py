@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache:
+
+    def __init__(self, max_size=256, ttl=None, clock=monotonic, max_bytes=None, weigh=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.max_bytes = max_bytes
+        self.weigh = weigh
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > self.clock():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        expires = None if not self.ttl else self.clock() + self.ttl
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            if self.max_bytes is not None:
+                sizes = [self.weigh(value) for expires, value in self.entries.values()]
+                total = sum(sizes)
+                for size in sizes[:-1]:
+                    if total <= self.max_bytes:
+                        break
+                    self.entries.popitem(last=False)
+                    total -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,576 @@
+from bisect import bisect_left
+from collections import namedtuple
+import json
+import mmap
+from operator import itemgetter
+import os
+import struct
+import sys
+import unicodedata
+
+import numpy as np
+
+
+SEARCHABLE_FIELDS = ('song', 'artist', 'album')
+SORTABLE_FIELDS = (
+    'time',
+    'popularity',
+    'dance',
+    'energy',
+    'happy',
+    'acoustic',
+    'instrumental',
+    'speech',
+    'live',
+    'tempo',
+)
+DISPLAYED_FIELDS = SEARCHABLE_FIELDS + SORTABLE_FIELDS
+FACET_FIELDS = ('artist', 'album')
+FACET_LIMIT = 10
+PAYLOAD_FIELDS = DISPLAYED_FIELDS + ('spotify_track_id',)
+PAYLOAD_FIELDS_JSON = json.dumps(PAYLOAD_FIELDS).encode()
+PAYLOAD_GETTER = itemgetter(*PAYLOAD_FIELDS)
+INTERNED_INDEXES = tuple(PAYLOAD_FIELDS.index(field) for field in ('song', 'artist', 'album', 'time'))
+FULL_SORT_RATIO = 0.25
+PERMUTATION_RATIO = 0.05
+
+CATALOG_MAGIC = b"HSCATLG\0"
+CATALOG_VERSION = 5
+CATALOG_SCHEMA = {
+    "searchable": list(SEARCHABLE_FIELDS),
+    "sortable": list(SORTABLE_FIELDS),
+    "payload": list(PAYLOAD_FIELDS),
+    "facets": list(FACET_FIELDS),
+}
+CATALOG_HEADER = struct.Struct("<8sII")
+CATALOG_ALIGNMENT = 64
+
+
+class CatalogFormatError(Exception):
+    pass
+
+
+def time_to_int(value):
+    minutes, seconds = value.split(":")
+    return int(minutes) * 60 + int(seconds)
+
+
+def fold(value):
+    if value.isascii():
+        return value.lower()
+    decomposed = unicodedata.normalize("NFKD", value.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def fold_all(values):
+    folded = {}
+    return [
+        folded[value] if value in folded else folded.setdefault(value, fold(value))
+        for value in values
+    ]
+
+
+def align(offset):
+    return -(-offset // CATALOG_ALIGNMENT) * CATALOG_ALIGNMENT
+
+
+class StringColumn:
+
+    def __init__(self, offsets, data, text=False):
+        self.offsets = offsets
+        self.data = data
+        self.text = text
+
+    @classmethod
+    def from_values(cls, values, text=False):
+        encoded = [value.encode() for value in values] if text else list(values)
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, data, text=text)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        value = self.data[self.offsets[index]:self.offsets[index + 1]].tobytes()
+        return value.decode() if self.text else value
+
+
+class SongRecord(namedtuple('SongRecord', PAYLOAD_FIELDS)):
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row):
+        values = list(PAYLOAD_GETTER(row))
+        for index in INTERNED_INDEXES:
+            values[index] = sys.intern(values[index])
+        return cls._make(values)
+
+
+class Catalog:
+
+    def __init__(self, rows):
+        records = [row if isinstance(row, SongRecord) else SongRecord.from_row(row) for row in rows]
+        self.path = None
+        self.track_rows = None
+        self.all_rows = None
+        self.size = len(records)
+        columns = dict(zip(SongRecord._fields, zip(*records))) or dict.fromkeys(SongRecord._fields, ())
+        strings = {field: columns[field] for field in SEARCHABLE_FIELDS}
+        self.track_ids = StringColumn.from_values(columns['spotify_track_id'], text=True)
+        self.fragments = StringColumn.from_values(json.dumps(record._asdict()).encode() for record in records)
+        self.row_fragments = StringColumn.from_values(json.dumps(record).encode() for record in records)
+        folded = {field: fold_all(strings[field]) for field in SEARCHABLE_FIELDS}
+        self.build_search_index(folded)
+        self.columns = {}
+        for field in SORTABLE_FIELDS:
+            if field == 'time':
+                values = [time_to_int(value) for value in columns[field]]
+            else:
+                values = columns[field]
+            self.columns[field] = np.array(values, dtype=np.int64)
+        self.max_tempo = int(self.columns['tempo'].max(initial=0))
+        self.max_time = int(self.columns['time'].max(initial=0))
+        self.build_orders(strings, folded)
+        self.build_filters(strings)
+
+    @classmethod
+    def open(cls, path):
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_size = CATALOG_HEADER.unpack_from(buffer)
+        if magic != CATALOG_MAGIC:
+            raise CatalogFormatError(f"{path} is not a catalog file")
+        if version != CATALOG_VERSION:
+            raise CatalogFormatError(f"{path} has unsupported catalog version {version}")
+        header = json.loads(buffer[CATALOG_HEADER.size:CATALOG_HEADER.size + header_size])
+        if header["schema"] != CATALOG_SCHEMA:
+            raise CatalogFormatError(f"{path} was written for a different field schema")
+        data_start = align(CATALOG_HEADER.size + header_size)
+        arrays = {
+            name: np.frombuffer(
+                buffer, dtype=spec["dtype"], count=spec["count"], offset=data_start + spec["offset"]
+            )
+            for name, spec in header["arrays"].items()
+        }
+        catalog = cls.__new__(cls)
+        catalog.path = path
+        catalog.track_rows = None
+        catalog.all_rows = None
+        catalog.size = header["size"]
+        catalog.max_tempo = header["max_tempo"]
+        catalog.max_time = header["max_time"]
+        catalog.attach(arrays)
+        return catalog
+
+    def attach(self, arrays):
+        self.track_ids = StringColumn(arrays["track_ids.offsets"], arrays["track_ids.data"], text=True)
+        self.fragments = StringColumn(arrays["fragments.offsets"], arrays["fragments.data"])
+        self.row_fragments = StringColumn(arrays["row_fragments.offsets"], arrays["row_fragments.data"])
+        self.text = arrays["text"]
+        self.text_offsets = arrays["text_offsets"]
+        self.trigrams = arrays["trigrams"]
+        self.trigram_offsets = arrays["trigram_offsets"]
+        self.trigram_rows = arrays["trigram_rows"]
+        self.default_order = arrays["default_order"]
+        self.default_rank = arrays["default_rank"]
+        self.columns = {}
+        self.normalized = {}
+        self.ascending = {}
+        self.descending = {}
+        self.range_order = {}
+        self.range_values = {}
+        self.facet_values = {}
+        self.facet_codes = {}
+        self.facet_offsets = {}
+        self.facet_rows = {}
+        for field in SORTABLE_FIELDS:
+            self.columns[field] = arrays[f"columns.{field}"]
+            self.normalized[field] = arrays[f"normalized.{field}"]
+            self.ascending[field] = arrays[f"ascending.{field}"]
+            self.descending[field] = arrays[f"descending.{field}"]
+            self.range_order[field] = arrays[f"range_order.{field}"]
+            self.range_values[field] = arrays[f"range_values.{field}"]
+        for field in FACET_FIELDS:
+            self.facet_values[field] = StringColumn(
+                arrays[f"facet_values.{field}.offsets"], arrays[f"facet_values.{field}.data"], text=True
+            )
+            self.facet_codes[field] = arrays[f"facet_codes.{field}"]
+            self.facet_offsets[field] = arrays[f"facet_offsets.{field}"]
+            self.facet_rows[field] = arrays[f"facet_rows.{field}"]
+
+    def rows(self):
+        for index in range(self.size):
+            yield json.loads(self.fragments[index])
+
+    def arrays(self):
+        arrays = {
+            "track_ids.offsets": self.track_ids.offsets,
+            "track_ids.data": self.track_ids.data,
+            "fragments.offsets": self.fragments.offsets,
+            "fragments.data": self.fragments.data,
+            "row_fragments.offsets": self.row_fragments.offsets,
+            "row_fragments.data": self.row_fragments.data,
+            "text": self.text,
+            "text_offsets": self.text_offsets,
+            "trigrams": self.trigrams,
+            "trigram_offsets": self.trigram_offsets,
+            "trigram_rows": self.trigram_rows,
+            "default_order": self.default_order,
+            "default_rank": self.default_rank,
+        }
+        for field in SORTABLE_FIELDS:
+            arrays[f"columns.{field}"] = self.columns[field]
+            arrays[f"normalized.{field}"] = self.normalized[field]
+            arrays[f"ascending.{field}"] = self.ascending[field]
+            arrays[f"descending.{field}"] = self.descending[field]
+            arrays[f"range_order.{field}"] = self.range_order[field]
+            arrays[f"range_values.{field}"] = self.range_values[field]
+        for field in FACET_FIELDS:
+            arrays[f"facet_values.{field}.offsets"] = self.facet_values[field].offsets
+            arrays[f"facet_values.{field}.data"] = self.facet_values[field].data
+            arrays[f"facet_codes.{field}"] = self.facet_codes[field]
+            arrays[f"facet_offsets.{field}"] = self.facet_offsets[field]
+            arrays[f"facet_rows.{field}"] = self.facet_rows[field]
+        return arrays
+
+    def save(self, path):
+        arrays = self.arrays()
+        specs = {}
+        offset = 0
+        for name, array in arrays.items():
+            offset = align(offset)
+            specs[name] = {"dtype": array.dtype.str, "count": len(array), "offset": offset}
+            offset += array.nbytes
+        header = json.dumps({
+            "size": self.size,
+            "max_tempo": self.max_tempo,
+            "max_time": self.max_time,
+            "schema": CATALOG_SCHEMA,
+            "arrays": specs,
+        }).encode()
+        data_start = align(CATALOG_HEADER.size + len(header))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(CATALOG_HEADER.pack(CATALOG_MAGIC, CATALOG_VERSION, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + specs[name]["offset"])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + align(offset))
+        os.replace(tmp_path, path)
+
+    def build_search_index(self, strings):
+        texts = [
+            "\0".join(values).encode() + b"\0"
+            for values in zip(*(strings[field] for field in SEARCHABLE_FIELDS))
+        ]
+        self.text_offsets = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in texts], out=self.text_offsets[1:])
+        self.text = np.frombuffer(b"".join(texts), dtype=np.uint8)
+
+        text = self.text.astype(np.int64)
+        first, second, third = text[:-2], text[1:-1], text[2:]
+        positions = np.flatnonzero((first != 0) & (second != 0) & (third != 0))
+        codes = (first[positions] << 16) | (second[positions] << 8) | third[positions]
+        rows = np.searchsorted(self.text_offsets, positions, side="right") - 1
+        pairs = np.sort((codes << 32) | rows)
+        pairs = pairs[np.append(True, pairs[1:] != pairs[:-1])[:len(pairs)]]
+        trigrams = pairs >> 32
+        starts = np.flatnonzero(np.append(True, trigrams[1:] != trigrams[:-1])[:len(trigrams)])
+        self.trigrams = trigrams[starts]
+        self.trigram_offsets = np.append(starts, len(pairs))
+        self.trigram_rows = (pairs & 0xFFFFFFFF).astype(np.int32)
+
+    def songs_json(self, indices):
+        fragments = self.fragments
+        return b"[%s]" % b", ".join([fragments[index] for index in indices.tolist()])
+
+    def page_json(self, indices, page, max_page, cursor=None, facets=None):
+        songs = self.songs_json(indices)
+        return b'{"songs": %s, "page": %d, "max_page": %d, "cursor": %s, "facets": %s}' % (
+            songs, page, max_page, json.dumps(cursor).encode(), json.dumps(facets).encode()
+        )
+
+    def page_json_compact(self, indices, page, max_page, known=frozenset(), cursor=None, facets=None):
+        track_ids, row_fragments = self.track_ids, self.row_fragments
+        rows = []
+        for index in indices.tolist():
+            track_id = track_ids[index]
+            if track_id in known:
+                rows.append(json.dumps(track_id).encode())
+            else:
+                rows.append(row_fragments[index])
+        return b'{"fields": %s, "rows": [%s], "page": %d, "max_page": %d, "cursor": %s, "facets": %s}' % (
+            PAYLOAD_FIELDS_JSON, b", ".join(rows), page, max_page,
+            json.dumps(cursor).encode(), json.dumps(facets).encode(),
+        )
+
+    def build_orders(self, strings, folded):
+        title_keys = {title: (key, title.upper()) for title, key in zip(strings['song'], folded['song'])}
+        ranks = {key: rank for rank, key in enumerate(sorted(set(title_keys.values())))}
+        title_ranks = np.array([ranks[title_keys[title]] for title in strings['song']], dtype=np.int32)
+        self.default_order = np.argsort(title_ranks, kind='stable').astype(np.int32)
+        self.default_rank = np.empty(self.size, dtype=np.int32)
+        self.default_rank[self.default_order] = np.arange(self.size, dtype=np.int32)
+        self.normalized = {}
+        self.ascending = {}
+        self.descending = {}
+        for field in SORTABLE_FIELDS:
+            values = self.columns[field]
+            if field == 'tempo':
+                values = values * 100 // self.max_tempo
+            elif field == 'time':
+                values = values * 100 // self.max_time
+            values = values.astype(np.float64)
+            self.normalized[field] = values
+            self.ascending[field] = np.argsort(values, kind='stable').astype(np.int32)
+            self.descending[field] = np.argsort(-values, kind='stable').astype(np.int32)
+
+    def build_filters(self, strings):
+        self.range_order = {}
+        self.range_values = {}
+        for field in SORTABLE_FIELDS:
+            order = np.argsort(self.columns[field], kind='stable').astype(np.int32)
+            self.range_order[field] = order
+            self.range_values[field] = self.columns[field][order]
+        self.facet_values = {}
+        self.facet_codes = {}
+        self.facet_offsets = {}
+        self.facet_rows = {}
+        for field in FACET_FIELDS:
+            values = sorted(set(strings[field]))
+            codes = {value: code for code, value in enumerate(values)}
+            row_codes = np.array([codes[value] for value in strings[field]], dtype=np.int32)
+            self.facet_values[field] = StringColumn.from_values(values, text=True)
+            self.facet_codes[field] = row_codes
+            self.facet_offsets[field] = np.zeros(len(values) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(row_codes, minlength=len(values)), out=self.facet_offsets[field][1:])
+            self.facet_rows[field] = np.argsort(row_codes, kind='stable').astype(np.int32)
+
+    def text_rows(self, positions):
+        rows = (np.searchsorted(self.text_offsets, positions, side="right") - 1).astype(np.int32)
+        return rows[np.append(True, rows[1:] != rows[:-1])] if len(rows) else rows
+
+    def trigram_postings(self, code):
+        index = np.searchsorted(self.trigrams, code)
+        if index == len(self.trigrams) or self.trigrams[index] != code:
+            return None
+        start, end = self.trigram_offsets[index], self.trigram_offsets[index + 1]
+        return self.trigram_rows[start:end]
+
+    def every_row(self):
+        if self.all_rows is None:
+            rows = np.arange(self.size, dtype=np.int32)
+            rows.flags.writeable = False
+            self.all_rows = rows
+        return self.all_rows
+
+    def search(self, search, within=None):
+        if not search:
+            return self.every_row()
+        needle = search.encode()
+        if b"\0" in needle:
+            return self.every_row()[:0]
+        if len(needle) < 3:
+            text = self.text
+            mask = text[:len(text) - len(needle) + 1] == needle[0]
+            if len(needle) == 2:
+                mask &= text[1:] == needle[1]
+            return self.text_rows(np.flatnonzero(mask))
+        codes = {
+            (needle[i] << 16) | (needle[i + 1] << 8) | needle[i + 2]
+            for i in range(len(needle) - 2)
+        }
+        postings = []
+        for code in codes:
+            rows = self.trigram_postings(code)
+            if rows is None:
+                return self.every_row()[:0]
+            postings.append(rows)
+        if within is not None:
+            postings.append(within)
+        postings.sort(key=len)
+        candidates = postings[0]
+        for rows in postings[1:]:
+            candidates = candidates[sorted_contains(rows, candidates)]
+            if not len(candidates):
+                return candidates
+        if len(needle) == 3 and within is None:
+            return candidates
+        return self.verify(candidates, needle)
+
+    def verify(self, candidates, needle):
+        starts = self.text_offsets[candidates]
+        lengths = self.text_offsets[candidates + 1] - starts
+        offsets = np.zeros(len(candidates) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], lengths)
+        text = self.text[positions]
+        matched = np.ones(max(len(text) - len(needle) + 1, 0), dtype=bool)
+        for shift, byte in enumerate(needle):
+            matched &= text[shift:shift + len(matched)] == byte
+        rows = np.searchsorted(offsets, np.flatnonzero(matched), side="right") - 1
+        if len(rows):
+            rows = rows[np.append(True, rows[1:] != rows[:-1])]
+        return candidates[rows]
+
+    def range_rows(self, field, low=None, high=None):
+        values = self.range_values[field]
+        start = 0 if low is None else np.searchsorted(values, low, side="left")
+        end = len(values) if high is None else np.searchsorted(values, high, side="right")
+        return self.range_order[field][start:end]
+
+    def facet_code(self, field, value):
+        values = self.facet_values[field]
+        code = bisect_left(values, value)
+        if code == len(values) or values[code] != value:
+            return None
+        return code
+
+    def facet_matches(self, field, value):
+        code = self.facet_code(field, value)
+        if code is None:
+            return self.facet_rows[field][:0]
+        offsets = self.facet_offsets[field]
+        return self.facet_rows[field][offsets[code]:offsets[code + 1]]
+
+    def filter(self, indices, ranges=None, facets=None):
+        candidates = [self.facet_matches(field, value) for field, value in (facets or {}).items()]
+        candidates.extend(self.range_rows(field, low, high) for field, (low, high) in (ranges or {}).items())
+        if not candidates:
+            return indices
+        if len(indices) < self.size:
+            candidates.append(indices)
+        candidates.sort(key=len)
+        selected = np.sort(candidates[0])
+        mask = np.zeros(self.size, dtype=bool)
+        for rows in candidates[1:]:
+            if not len(selected):
+                break
+            mask[rows] = True
+            selected = selected[mask[selected]]
+            mask[rows] = False
+        return selected
+
+    def facet_counts(self, indices, limit=FACET_LIMIT):
+        facets = {}
+        for field in FACET_FIELDS:
+            values = self.facet_values[field]
+            counts = np.bincount(self.facet_codes[field][indices], minlength=len(values))
+            codes = np.flatnonzero(counts)
+            codes, keys = top_k(codes, -counts[codes], min(limit, len(codes)))
+            codes = codes[np.lexsort((codes, keys))]
+            facets[field] = [[values[code], int(counts[code])] for code in codes.tolist()]
+        return facets
+
+    def score(self, indices, weights):
+        score = np.zeros(len(indices), dtype=np.float64)
+        for field, factor in weights.items():
+            score += self.normalized[field][indices] * factor
+        return score
+
+    def permutation(self, weights):
+        if not weights:
+            return self.default_order
+        if len(weights) == 1:
+            (field, factor), = weights.items()
+            if factor > 0:
+                return self.descending[field]
+            if factor < 0:
+                return self.ascending[field]
+        return None
+
+    def row_index(self, track_id):
+        if self.track_rows is None:
+            self.track_rows = {self.track_ids[index]: index for index in range(self.size)}
+        return self.track_rows.get(track_id)
+
+    def sort_keys(self, indices, weights=None):
+        if weights:
+            return -self.score(indices, weights), indices
+        keys = self.default_rank[indices]
+        return keys, keys
+
+    def after(self, indices, weights, key, tie):
+        keys, ties = self.sort_keys(indices, weights)
+        return (keys > key) | ((keys == key) & (ties > tie))
+
+    def order(self, indices, weights=None, limit=None):
+        permutation = self.permutation(weights)
+        if permutation is not None:
+            if len(indices) == self.size:
+                return permutation[:limit]
+            if len(indices) > self.size * PERMUTATION_RATIO:
+                mask = np.zeros(self.size, dtype=bool)
+                mask[indices] = True
+                return permutation[mask[permutation]][:limit]
+        if weights:
+            keys = -self.score(indices, weights)
+        else:
+            keys = self.default_rank[indices]
+        if limit is not None and limit < len(keys) * FULL_SORT_RATIO:
+            indices, keys = top_k(indices, keys, limit)
+        return indices[np.argsort(keys, kind='stable')][:limit]
+
+
+class QueryResult:
+
+    def __init__(self, catalog, matches, weights=None):
+        self.catalog = catalog
+        self.matches = matches
+        self.weights = weights
+        self.ordered = matches[:0]
+        self.facets = None
+
+    def __len__(self):
+        return len(self.matches)
+
+    def slice(self, start, stop):
+        ordered = self.ordered
+        if len(ordered) < min(stop, len(self.matches)):
+            limit = max(stop, 2 * len(ordered))
+            ordered = self.catalog.order(self.matches, self.weights, limit=limit)
+            self.ordered = ordered
+        return ordered[start:stop]
+
+    def nbytes(self):
+        return self.matches.nbytes + self.ordered.nbytes
+
+    def facet_counts(self):
+        if self.facets is None:
+            self.facets = self.catalog.facet_counts(self.matches)
+        return self.facets
+
+    def resume(self, position, key, track_id, count):
+        catalog = self.catalog
+        ordered = self.ordered
+        if 0 < position <= len(ordered) and catalog.track_ids[ordered[position - 1]] == track_id:
+            return position, self.slice(position, position + count)
+        row = catalog.row_index(track_id)
+        if row is not None:
+            keys, ties = catalog.sort_keys(np.array([row]), self.weights)
+            key, tie = keys[0], ties[0]
+        else:
+            tie = -1
+        after = catalog.after(self.matches, self.weights, key, tie)
+        songs = catalog.order(self.matches[after], self.weights, limit=count)
+        return int(len(after) - np.count_nonzero(after)), songs
+
+
+def sorted_contains(rows, values):
+    if not len(rows):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(np.searchsorted(rows, values), len(rows) - 1)
+    return rows[positions] == values
+
+
+def top_k(indices, keys, k):
+    if k <= 0:
+        return indices[:0], keys[:0]
+    kth = np.partition(keys, k - 1)[k - 1]
+    selected = keys < kth
+    ties = np.flatnonzero(keys == kth)[:k - np.count_nonzero(selected)]
+    selected[ties] = True
+    return indices[selected], keys[selected]
@@ -1,5 +1,15 @@
+from argparse import ArgumentParser
+from concurrent.futures import as_completed, ProcessPoolExecutor
+from contextlib import suppress
 import csv
+from glob import glob
 import json
+import os
+from os.path import isdir, join as path_join
+import sys
+from time import perf_counter
+
+from catalog import Catalog
 
 NUMERICAL_DATA = (
     '#',
@@ -21,8 +31,11 @@ STRIPPED_DATA = (
 def slugify(string):
     return string.strip().replace(" ", "_").lower()
 
-def convert(path):
-    json_data = []
+def read_rows(path, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault("rows", 0)
+    stats.setdefault("rejected", 0)
     with open(path) as csv_file:
         reader = csv.DictReader(csv_file)
         for row in reader:
@@ -35,14 +48,106 @@ def convert(path):
                     if key in NUMERICAL_DATA:
                         value = int(value)
                     processed_row[key] = value
-            except ValueError:
-                continue
+            except (AttributeError, TypeError, ValueError):
+                stats["rejected"] += 1
             else:
-                json_data.append(processed_row)
-    with open(path + ".json", "w") as json_file:
-        json.dump(json_data, json_file, indent=4)
+                stats["rows"] += 1
+                yield processed_row
+
+def write_json(rows, path):
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w") as json_file:
+            separator = "[\n    "
+            for row in rows:
+                json_file.write(separator)
+                json_file.write(json.dumps(row, indent=4).replace("\n", "\n    "))
+                separator = ",\n    "
+            json_file.write("[]" if separator.startswith("[") else "\n]")
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+def convert(path, output_format="json"):
+    stats = {"path": path}
+    start = perf_counter()
+    rows = read_rows(path, stats)
+    if output_format == "json":
+        write_json(rows, path + ".json")
+    else:
+        rows = {row['spotify_track_id']: row for row in rows}
+        Catalog(rows.values()).save(path + ".catalog")
+    stats["seconds"] = perf_counter() - start
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+def read_file(path):
+    stats = {"path": path}
+    start = perf_counter()
+    rows = list(read_rows(path, stats))
+    stats["seconds"] = perf_counter() - start
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats, rows
+
+def csv_paths(paths):
+    for path in paths:
+        if isdir(path):
+            yield from sorted(glob(path_join(path, "*.csv")))
+        else:
+            yield path
+
+def convert_all(paths, output_format="json", processes=None):
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(convert, path, output_format): path for path in csv_paths(paths)}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as exc:
+                yield {"path": futures[future], "error": f"{type(exc).__name__}: {exc}"}
+
+def merge_all(paths, output, processes=None):
+    merged = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {executor.submit(read_file, path): path for path in csv_paths(paths)}
+        for future in as_completed(futures):
+            try:
+                stats, rows = future.result()
+            except Exception as exc:
+                yield {"path": futures[future], "error": f"{type(exc).__name__}: {exc}"}
+                continue
+            for row in rows:
+                merged[row['spotify_track_id']] = row
+            yield stats
+    stats = {"path": output, "rows": len(merged), "rejected": 0}
+    start = perf_counter()
+    Catalog(merged.values()).save(output)
+    stats["seconds"] = perf_counter() - start
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    yield stats
 
 
 if __name__ == "__main__":
-    import sys
-    convert(sys.argv[1])
+    parser = ArgumentParser()
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--format", choices=("catalog", "json"), default="json")
+    parser.add_argument("--processes", default=None, type=int)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    if args.output:
+        results = merge_all(args.paths, args.output, processes=args.processes)
+    else:
+        results = convert_all(args.paths, output_format=args.format, processes=args.processes)
+    failed = False
+    for stats in results:
+        if "error" in stats:
+            failed = True
+            print(f"{stats['path']}: failed, {stats['error']}", file=sys.stderr)
+            continue
+        print(
+            f"{stats['path']}: {stats['rows']} rows, {stats['rejected']} rejected, "
+            f"{stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s)"
+        )
+    if failed:
+        sys.exit(1)
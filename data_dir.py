@@ -0,0 +1,177 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from glob import glob
+import json
+from multiprocessing import get_context
+import os
+from os.path import join as path_join
+from tempfile import mkstemp
+from threading import Event, Thread
+from traceback import print_exc
+
+from catalog import Catalog, CatalogFormatError, SongRecord
+
+
+DATA_PATTERNS = ("*.catalog", "*.json")
+PARSED_FILES = {}
+
+
+def data_files(data_dir):
+    return [
+        path
+        for pattern in DATA_PATTERNS
+        for path in sorted(glob(path_join(data_dir, pattern)))
+    ]
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def merge_records(data, records, stats=None):
+    for track_id, record in records.items():
+        if stats is not None and track_id in data:
+            stats["duplicates"] += 1
+        data[track_id] = record
+    return data
+
+
+def read_data_file(path, stats=None):
+    if path.endswith(".catalog"):
+        rows = Catalog.open(path).rows()
+    else:
+        with open(path) as f:
+            rows = json.load(f)
+    records = {}
+    for row in rows:
+        record = SongRecord.from_row(row)
+        if stats is not None:
+            stats["rows"] += 1
+            if record.spotify_track_id in records:
+                stats["duplicates"] += 1
+        records[record.spotify_track_id] = record
+    return records
+
+
+def load_data(data_dir, stats=None):
+    if stats is None:
+        stats = {}
+    stats.setdefault("files", 0)
+    stats.setdefault("rows", 0)
+    stats.setdefault("duplicates", 0)
+    paths = data_files(data_dir)
+    if len(paths) == 1 and paths[0].endswith(".catalog"):
+        catalog = Catalog.open(paths[0])
+        stats["files"] += 1
+        stats["rows"] += catalog.size
+        return catalog
+    data = {}
+    for path in paths:
+        merge_records(data, read_data_file(path, stats), stats)
+        stats["files"] += 1
+    return data
+
+
+def build_catalog(data_dir, catalog_path):
+    stats = {"files": 0, "rows": 0, "duplicates": 0, "parsed": 0}
+    signatures = {}
+    for path in data_files(data_dir):
+        try:
+            signatures[path] = file_signature(path)
+        except FileNotFoundError:
+            continue
+    if len(signatures) == 1 and next(iter(signatures)).endswith(".catalog"):
+        path, = signatures
+        PARSED_FILES.clear()
+        stats["files"] = 1
+        stats["rows"] = Catalog.open(path).size
+        return path, signatures, stats
+    for path in list(PARSED_FILES):
+        if path not in signatures:
+            del PARSED_FILES[path]
+    data = {}
+    for path, signature in signatures.items():
+        entry = PARSED_FILES.get(path)
+        if entry is None or entry[0] != signature:
+            file_stats = {"rows": 0, "duplicates": 0}
+            try:
+                entry = (signature, read_data_file(path, file_stats), file_stats)
+            except (OSError, ValueError, KeyError, CatalogFormatError):
+                print_exc()
+                if entry is None:
+                    continue
+            else:
+                PARSED_FILES[path] = entry
+                stats["parsed"] += 1
+        signature, records, file_stats = entry
+        stats["files"] += 1
+        stats["rows"] += file_stats["rows"]
+        stats["duplicates"] += file_stats["duplicates"]
+        merge_records(data, records, stats)
+    Catalog(data.values()).save(catalog_path)
+    return catalog_path, signatures, stats
+
+
+class DataWatcher:
+
+    def __init__(self, data_dir, on_change=None, interval=2.0):
+        self.data_dir = data_dir
+        self.on_change = on_change
+        self.interval = interval
+        self.seen = None
+        self.catalog_path = None
+        self.executor = None
+        self.stopped = Event()
+        self.thread = None
+
+    def signatures(self):
+        signatures = {}
+        for path in data_files(self.data_dir):
+            try:
+                signatures[path] = file_signature(path)
+            except FileNotFoundError:
+                continue
+        return signatures
+
+    def load(self):
+        if self.catalog_path is None:
+            fd, self.catalog_path = mkstemp(suffix=".catalog")
+            os.close(fd)
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"))
+        try:
+            path, self.seen, stats = self.executor.submit(build_catalog, self.data_dir, self.catalog_path).result()
+        except BrokenProcessPool:
+            self.executor = None
+            raise
+        return Catalog.open(path), stats
+
+    def scan(self):
+        if self.signatures() == self.seen:
+            return False
+        catalog, stats = self.load()
+        self.on_change(catalog)
+        return True
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.scan()
+            except Exception:
+                print_exc()
+
+    def start(self):
+        if self.seen is None:
+            self.seen = self.signatures()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.executor is not None:
+            self.executor.shutdown()
+        if self.catalog_path is not None and os.path.exists(self.catalog_path):
+            os.remove(self.catalog_path)
@@ -1,10 +1,12 @@
 from argparse import ArgumentParser
-from glob import glob
+import asyncio
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from hashlib import sha256
 import json
-from html.parser import HTMLParser
-from os.path import join as path_join
-from urllib.parse import unquote
-from urllib.request import urlopen
+import os
+from tempfile import mkstemp
+from threading import Lock
 
 from pyttp import css as c
 from pyttp.form import Field, Form, TextField
@@ -21,24 +23,34 @@ from pyttp.pagination import paginate
 from pyttp.scaffold import make_controller_root, wrap_root
 from pyttp.validators import ValidationException
 
+from assets import AssetCache, CompressionMiddleware, content_version
+from cache import LRUCache
+from catalog import (
+    Catalog,
+    DISPLAYED_FIELDS,
+    FACET_FIELDS,
+    fold,
+    QueryResult,
+    SEARCHABLE_FIELDS,
+    SORTABLE_FIELDS,
+    time_to_int,
+)
+from data_dir import DataWatcher, load_data
+from metrics import METRICS, MetricsMiddleware, SamplingProfiler
+from neighbours import SimilarityIndex
+from preview import PreviewPrefetcher, PreviewResolver, SPOTIFY_URL, valid_track_id
 from reset_css import reset
+from serving import AsyncApp, serve_async, serve_prefork
 
 
-SEARCHABLE_FIELDS = ('song', 'artist', 'album')
-SORTABLE_FIELDS = (
-    'time',
-    'popularity',
-    'dance',
-    'energy',
-    'happy',
-    'acoustic',
-    'instrumental',
-    'speech',
-    'live',
-    'tempo',
-)
-DISPLAYED_FIELDS = SEARCHABLE_FIELDS + SORTABLE_FIELDS
 BASE_HUE = 210
+KNOWN_PAGES = 2
+ASSET_PATHS = {
+    "/": "index",
+    "/index": "index",
+    "/css_src": "css_src",
+    "/js_src": "js_src",
+}
 
 def css():
     return reset + c.rs(
@@ -77,12 +89,26 @@ def css():
                 c.r("th", font_weight="bold"),
             ),
             c.r("input.sort", width="50px"),
+            c.r("input.range", width="50px"),
         )
     )
 
-def time_to_int(value):
-    minutes, seconds = value.split(":")
-    return int(minutes) * 60 + int(seconds)
+def query_hash(key):
+    return sha256(repr(key).encode()).hexdigest()[:16]
+
+def encode_cursor(key, position, sort_key, track_id):
+    cursor = json.dumps([query_hash(key), position, sort_key, track_id])
+    return urlsafe_b64encode(cursor.encode()).decode()
+
+def decode_cursor(cursor, key):
+    try:
+        digest, position, sort_key, track_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        position, sort_key, track_id = int(position), float(sort_key), str(track_id)
+    except (Base64Error, ValueError, TypeError):
+        return None
+    if digest != query_hash(key):
+        return None
+    return position, sort_key, track_id
 
 def js():
     exports = {}
@@ -94,6 +120,10 @@ def js():
         template: let = select("#template")
         page: let = select("#page")
         preview: let = select("#preview")
+        song_cache: let = {}
+        recent_pages: let = []
+        next_cursor: let = ""
+        follow_cursor: let = False
         min_page = 1
         max_page = 1
 
@@ -101,6 +131,8 @@ def js():
         def reset(target, evt):
             evt.preventDefault()
             selectAll(".sort").val(0)
+            selectAll(".range").val("")
+            selectAll(".facet").val("")
             page.val(1)
             select("#search").val("")
             controls.trigger("change")
@@ -119,6 +151,7 @@ def js():
             next_page: let = int(page.value) + 1
             if next_page <= max_page:
                 page.val(next_page)
+                follow_cursor = True
             controls.trigger("change")
 
         def preview_ended(evt):
@@ -134,6 +167,12 @@ def js():
             url: let = controls.getAttribute("action")
             ajax: let | new = XMLHttpRequest()
             formData: let | new = FormData(select("form#controls"))
+            request_cache: let = song_cache
+            formData.append("format", "compact")
+            formData.append("known", Object.keys(request_cache).join(","))
+            if follow_cursor and next_cursor:
+                formData.append("cursor", next_cursor)
+            follow_cursor = False
 
             def scale_value(field, value, target):
                 scaling_factor = 100
@@ -151,8 +190,29 @@ def js():
 
                 songs.innerHTML = ''
 
+                fields: let = data["fields"]
+                page_songs: let = []
+                for row in data["rows"]:
+                    if Array.isArray(row):
+                        new_song: let = {}
+                        field_idx: let = 0
+                        for field in fields:
+                            new_song[field] = row[field_idx]
+                            field_idx += 1
+                        page_songs.push(new_song)
+                    else:
+                        page_songs.push(request_cache[row])
+
+                recent_pages.push(page_songs)
+                if recent_pages.length > known_pages:
+                    recent_pages.shift()
+                song_cache = {}
+                for recent_page in recent_pages:
+                    for cached_song in recent_page:
+                        song_cache[cached_song["spotify_track_id"]] = cached_song
+
                 idx: let = 0
-                for song in data["songs"]:
+                for song in page_songs:
                     track_id: let = song["spotify_track_id"]
                     row = template.cloneNode(True)
                     for field_elem in row.childNodes:
@@ -183,6 +243,15 @@ def js():
                 if pause:
                     preview.pause()
                 max_page = data["max_page"]
+                next_cursor = data["cursor"]
+                for facet_field in facet_fields:
+                    datalist: let = select(f"#{facet_field}-facets")
+                    datalist.innerHTML = ''
+                    for facet in data["facets"][facet_field]:
+                        option: let = document.createElement("option")
+                        option.value = facet[0]
+                        option.textContent = f"{facet[0]} ({facet[1]})"
+                        datalist.appendChild(option)
                 page.setAttribute("max", max_page)
                 if not page.value:
                     page.value = 1
@@ -239,34 +308,6 @@ def js():
     return exports
 
 
-def load_data(data_dir):
-    data = {}
-    json_files = glob(path_join(data_dir, "*.json"))
-    for json_file in json_files:
-        with open(json_file) as f:
-            json_data = json.load(f)
-            data.update({row['spotify_track_id']: row for row in json_data})
-    return data
-
-
-class SpotifyResourceParser(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.resource = ""
-        self.tag_found = False
-
-    def handle_starttag(self, tag, attrs):
-        dict_attrs = dict(attrs)
-        if tag == "script" and dict_attrs.get("id") == "resource":
-            self.tag_found = True
-        else:
-            self.tag_found = False
-
-    def handle_data(self, data):
-        if self.tag_found and data.strip():
-            self.resource = data
-
-
 class SortDirectionField(Field):
     def render(self):
         return f'''
@@ -280,6 +321,40 @@ def validate_int(value):
         raise ValidationException("Not a valid integer.") from exc
     return value
 
+def parse_range_value(value):
+    value = (value or "").strip()
+    if not value:
+        return None
+    if ":" in value:
+        return time_to_int(value)
+    return float(value)
+
+def validate_range_value(value):
+    try:
+        value = parse_range_value(value)
+    except (TypeError, ValueError) as exc:
+        raise ValidationException("Not a valid number or m:ss time.") from exc
+    return value
+
+class RangeField(TextField):
+    default_validators = [validate_range_value]
+
+    def __init__(self, name=None, placeholder="", **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.placeholder = placeholder
+
+    def render(self):
+        return f'''
+            <input class="range" type="text" placeholder="{self.placeholder}" name="{self.name}" id="{self.id}" value="">
+        '''
+
+class FacetField(TextField):
+    def render(self):
+        return f'''
+            <input class="facet" type="text" placeholder="{self.name.capitalize()}" list="{self.name}-facets" name="{self.name}" id="{self.id}" value="">
+            <datalist id="{self.name}-facets"></datalist>
+        '''
+
 class IntegerField(TextField):
     default_validators = [validate_int]
 
@@ -311,6 +386,13 @@ class IntegerField(TextField):
         return ''.join(outp)
 
 
+BATCH_DEFAULTS = dict({field: "0" for field in SORTABLE_FIELDS}, page="1")
+
+
+class BatchForm(Form):
+    queries = TextField("queries")
+
+
 class FilterForm(Form):
     search = TextField("search")
     page = IntegerField("page", min_value=1, value=1)
@@ -324,75 +406,260 @@ class FilterForm(Form):
     speech = SortDirectionField("speech")
     live = SortDirectionField("live")
     tempo = SortDirectionField("tempo")
+    time_min = RangeField("time_min", placeholder="min")
+    time_max = RangeField("time_max", placeholder="max")
+    popularity_min = RangeField("popularity_min", placeholder="min")
+    popularity_max = RangeField("popularity_max", placeholder="max")
+    happy_min = RangeField("happy_min", placeholder="min")
+    happy_max = RangeField("happy_max", placeholder="max")
+    dance_min = RangeField("dance_min", placeholder="min")
+    dance_max = RangeField("dance_max", placeholder="max")
+    energy_min = RangeField("energy_min", placeholder="min")
+    energy_max = RangeField("energy_max", placeholder="max")
+    acoustic_min = RangeField("acoustic_min", placeholder="min")
+    acoustic_max = RangeField("acoustic_max", placeholder="max")
+    instrumental_min = RangeField("instrumental_min", placeholder="min")
+    instrumental_max = RangeField("instrumental_max", placeholder="max")
+    speech_min = RangeField("speech_min", placeholder="min")
+    speech_max = RangeField("speech_max", placeholder="max")
+    live_min = RangeField("live_min", placeholder="min")
+    live_max = RangeField("live_max", placeholder="max")
+    tempo_min = RangeField("tempo_min", placeholder="min")
+    tempo_max = RangeField("tempo_max", placeholder="max")
+    artist = FacetField("artist")
+    album = FacetField("album")
+    format = TextField("format")
+    known = TextField("known")
+    cursor = TextField("cursor")
 
 
 class MusicController(Controller):
 
-    def __init__(self, data, songs_per_page=50):
-        self.data = list(data.values())
+    def __init__(self, data, songs_per_page=50, cache_size=256, cache_ttl=None,
+                 previews=None, prefetcher=None, similar_count=10, batch_limit=20,
+                 search_cache_size=64, cache_bytes=256 * 1024 * 1024):
         self.songs_per_page = songs_per_page
+        self.batch_limit = batch_limit
+        self.similar_count = similar_count
+        self.previews = previews if previews is not None else PreviewResolver()
+        self.prefetcher = prefetcher
         self.css = None
         self.js = None
-        self.field_value_percent = {
-            'tempo': self.tempo_to_percent,
-            'time': self.time_to_percent,
-        }
-        self.max_tempo = max(song["tempo"] for song in self.data)
-        self.max_time = max(time_to_int(song["time"]) for song in self.data)
-
-    def time_to_percent(self, value):
-        return time_to_int(value) * 100 // self.max_time
-
-    def tempo_to_percent(self, value):
-        return value * 100 // self.max_tempo
-
-    def get_sort_key(self, mapping):
-
-        def key(song):
-            score = 0
-            for field, factor in mapping.items():
-                value = song[field]
-                if field in self.field_value_percent:
-                    value = self.field_value_percent[field](value)
-                score += value * factor
-            return score
-        return key
+        self.results = LRUCache(
+            max_size=cache_size, ttl=cache_ttl, max_bytes=cache_bytes, weigh=QueryResult.nbytes
+        )
+        self.match_sets = LRUCache(
+            max_size=cache_size, ttl=cache_ttl, max_bytes=cache_bytes, weigh=lambda entry: entry[1].nbytes
+        )
+        self.searches = LRUCache(
+            max_size=search_cache_size, max_bytes=cache_bytes, weigh=lambda entry: entry[1].nbytes
+        )
+        self.similarity_lock = Lock()
+        METRICS.collect("hacksprint_query_cache_total", lambda: self.results.hits, (("result", "hit"),))
+        METRICS.collect("hacksprint_query_cache_total", lambda: self.results.misses, (("result", "miss"),))
+        self.load(data)
+
+    def load(self, data):
+        catalog = data if isinstance(data, Catalog) else Catalog(data.values())
+        self.similarity = None
+        self.catalog = catalog
+        self.max_tempo = catalog.max_tempo
+        self.max_time = catalog.max_time
+        self.js = None
+        self.results.clear()
+        self.match_sets.clear()
+        self.searches.clear()
+
+    def similarity_index(self):
+        catalog = self.catalog
+        similarity = self.similarity
+        if similarity is None or similarity.catalog is not catalog:
+            with self.similarity_lock:
+                similarity = self.similarity
+                if similarity is None or similarity.catalog is not catalog:
+                    similarity = self.similarity = SimilarityIndex(catalog)
+        return similarity
+
+    def query_key(self, search, sorting_fields, ranges=None, facets=None):
+        return (
+            search,
+            tuple(sorting_fields.get(field, 0.0) for field in SORTABLE_FIELDS),
+            tuple(sorted((ranges or {}).items())),
+            tuple(sorted((facets or {}).items())),
+        )
 
-    @expose
-    @inject_header(('Content-Type', 'application/json'))
-    def json(self, request):
-        form = FilterForm(request.POST)
-        sort_key = lambda song: song["song"].upper()
-        reverse = False
-        page = 1
+    def search(self, catalog, search):
+        if len(search) < 3:
+            return catalog.search(search)
+        cached = self.searches.get(search)
+        if cached is not None and cached[0] is catalog:
+            return cached[1]
+        within = None
+        for end in range(len(search) - 1, 2, -1):
+            cached = self.searches.get(search[:end])
+            if cached is not None and cached[0] is catalog:
+                within = cached[1]
+                break
+        matches = catalog.search(search, within)
+        self.searches.set(search, (catalog, matches))
+        return matches
+
+    def match_set(self, catalog, search, ranges=None, facets=None):
+        key = self.query_key(search, {}, ranges, facets)
+        cached = self.match_sets.get(key)
+        if cached is not None and cached[0] is catalog:
+            return cached[1]
+        matches = catalog.filter(self.search(catalog, search), ranges, facets)
+        self.match_sets.set(key, (catalog, matches))
+        return matches
+
+    def query(self, search, sorting_fields, ranges=None, facets=None, catalog=None, find_matches=None):
+        if catalog is None:
+            catalog = self.catalog
+        key = self.query_key(search, sorting_fields, ranges, facets)
+        result = self.results.get(key)
+        if result is None or result.catalog is not catalog:
+            if find_matches is None:
+                matches = self.match_set(catalog, search, ranges, facets)
+            else:
+                matches = find_matches()
+            result = QueryResult(catalog, matches, sorting_fields)
+            self.results.set(key, result)
+        return result
+
+    def read_form(self, form):
+        params = dict(
+            page=1,
+            search="",
+            sorting_fields={},
+            ranges={},
+            facets={},
+            compact=False,
+            known=frozenset(),
+            cursor=None,
+        )
         if form.is_valid():
-            page = int(form.fields["page"].value)
-            songs = []
-            search = form.fields["search"].value.lower().strip()
-            for song in self.data:
-                for field in SEARCHABLE_FIELDS:
-                    if search in song[field].lower():
-                        songs.append(song)
-                        break
-            sorting_fields = {}
+            params["page"] = int(form.fields["page"].value)
+            params["cursor"] = form.fields["cursor"].value
+            params["compact"] = form.fields["format"].value == "compact"
+            params["known"] = frozenset(filter(None, (form.fields["known"].value or "").split(",")))
+            params["search"] = fold(form.fields["search"].value).strip()
             for field in SORTABLE_FIELDS:
                 value = float(form.fields[field].value)
                 if value:
-                    sorting_fields[field] = value
-            if sorting_fields:
-                sort_key = self.get_sort_key(sorting_fields)
-                reverse = True
-        else:
-            songs = self.data
-        songs = sorted(songs, key=sort_key, reverse=reverse)
-        num_songs = len(songs)
-        max_page = (num_songs // self.songs_per_page) + 1
-        if page > max_page:
-            page = max_page
-        max_song = page * self.songs_per_page
-        min_song = (page - 1) * self.songs_per_page
-        songs = songs[min_song:max_song]
-        return ControllerResponse(json.dumps({"songs": songs, "page": page, "max_page": max_page}))
+                    params["sorting_fields"][field] = value
+                low = parse_range_value(form.fields[f"{field}_min"].value)
+                high = parse_range_value(form.fields[f"{field}_max"].value)
+                if low is not None or high is not None:
+                    params["ranges"][field] = (low, high)
+            for field in FACET_FIELDS:
+                value = (form.fields[field].value or "").strip()
+                if value:
+                    params["facets"][field] = value
+        return params
+
+    def page_json(self, params, catalog=None, find_matches=None):
+        search, sorting_fields = params["search"], params["sorting_fields"]
+        ranges, facets = params["ranges"], params["facets"]
+        key = self.query_key(search, sorting_fields, ranges, facets)
+        with METRICS.span("json.search"):
+            result = self.query(search, sorting_fields, ranges, facets, catalog, find_matches)
+        num_songs = len(result)
+        max_page = max(1, -(-num_songs // self.songs_per_page))
+        with METRICS.span("json.order"):
+            resume = decode_cursor(params["cursor"], key) if params["cursor"] else None
+            if resume is not None:
+                min_song, songs = result.resume(*resume, self.songs_per_page)
+                page = min(min_song // self.songs_per_page + 1, max_page)
+            else:
+                page = min(params["page"], max_page)
+                min_song = (page - 1) * self.songs_per_page
+                songs = result.slice(min_song, min_song + self.songs_per_page)
+        next_cursor = None
+        next_song = min_song + len(songs)
+        if len(songs) and next_song < num_songs:
+            sort_keys, _ = result.catalog.sort_keys(songs[-1:], result.weights)
+            next_cursor = encode_cursor(
+                key, next_song, float(sort_keys[0]), result.catalog.track_ids[songs[-1]]
+            )
+        if self.prefetcher is not None:
+            track_ids = result.catalog.track_ids
+            self.prefetcher.submit([track_ids[index] for index in songs.tolist()])
+        with METRICS.span("json.facets"):
+            facet_counts = result.facet_counts()
+        with METRICS.span("json.encode"):
+            if params["compact"]:
+                return result.catalog.page_json_compact(
+                    songs, page, max_page, params["known"], next_cursor, facet_counts
+                )
+            return result.catalog.page_json(songs, page, max_page, next_cursor, facet_counts)
+
+    @expose
+    @inject_header(('Content-Type', 'application/json'))
+    def json(self, request):
+        with METRICS.span("json.form"):
+            params = self.read_form(FilterForm(request.POST))
+        return ControllerResponse(self.page_json(params).decode())
+
+    @expose
+    @inject_header(('Content-Type', 'application/json'))
+    def json_batch(self, request):
+        try:
+            payloads = json.loads(BatchForm(request.POST).fields["queries"].value or "[]")
+            if not isinstance(payloads, list) or not all(isinstance(payload, dict) for payload in payloads):
+                raise ValueError("queries must be a list of objects")
+            if len(payloads) > self.batch_limit:
+                raise ValueError(f"at most {self.batch_limit} queries per batch")
+        except ValueError as exc:
+            return ControllerResponse(json.dumps({"results": [], "error": str(exc)}))
+        with METRICS.span("json.form"):
+            batch = [
+                self.read_form(FilterForm({
+                    **BATCH_DEFAULTS,
+                    **{name: str(value) for name, value in payload.items() if value is not None},
+                }))
+                for payload in payloads
+            ]
+        catalog = self.catalog
+        searches = {}
+        filtered = {}
+
+        def shared_matches(search, ranges, facets):
+            filter_key = self.query_key(search, {}, ranges, facets)
+            if filter_key not in filtered:
+                if search not in searches:
+                    searches[search] = self.search(catalog, search)
+                filtered[filter_key] = catalog.filter(searches[search], ranges, facets)
+            return filtered[filter_key]
+
+        pages = [
+            self.page_json(
+                params,
+                catalog,
+                lambda params=params: shared_matches(params["search"], params["ranges"], params["facets"]),
+            )
+            for params in batch
+        ]
+        return ControllerResponse((b'{"results": [%s]}' % b", ".join(pages)).decode())
+
+    def render_js(self):
+        if self.js is None:
+            context = dict(
+                base_hue=BASE_HUE,
+                max_tempo=self.max_tempo,
+                max_time=self.max_time,
+                displayed_fields=DISPLAYED_FIELDS,
+                sortable_fields=SORTABLE_FIELDS,
+                facet_fields=FACET_FIELDS,
+                known_pages=KNOWN_PAGES,
+            )
+            self.js = toJS(js, time_to_int, context=context)
+        return self.js
+
+    def render_css(self):
+        if self.css is None:
+            self.css = css().format(pretty=True)
+        return self.css
 
     @expose
     def index(self, request):
@@ -402,62 +669,204 @@ class MusicController(Controller):
             form=form,
             searchable_fields=SEARCHABLE_FIELDS,
             sortable_fields=sortable_fields,
+            min_fields=[form.fields[f"{name}_min"] for name in SORTABLE_FIELDS],
+            max_fields=[form.fields[f"{name}_max"] for name in SORTABLE_FIELDS],
             displayed_fields=DISPLAYED_FIELDS,
+            css_url=f"/css_src?v={content_version(self.render_css().encode())}",
+            js_url=f"/js_src?v={content_version(self.render_js().encode())}",
         )
         return TemplateResponse("templates/index.pyml", context=context)
 
     @expose
     @inject_header(('Content-Type', 'application/javascript'))
     def js_src(self, request):
-        if self.js is None:
-            context = dict(
-                base_hue=BASE_HUE,
-                max_tempo=self.max_tempo,
-                max_time=self.max_time,
-                displayed_fields=DISPLAYED_FIELDS,
-                sortable_fields=SORTABLE_FIELDS,
-            )
-            self.js = toJS(js, time_to_int, context=context)
-
-        return ControllerResponse(self.js)
+        return ControllerResponse(self.render_js())
 
     @expose
     @inject_header(('Content-Type', 'text/css'))
     def css_src(self, request):
-        if self.css is None:
-            self.css = css().format(pretty=True)
-        return ControllerResponse(self.css)
+        return ControllerResponse(self.render_css())
 
     @expose
     @inject_header(('Content-Type', 'application/json'))
     @validate(track_id=str)
     def preview_url(self, request, track_id):
-        r = urlopen(f"https://open.spotify.com/embed/track/{track_id}")
-        parser = SpotifyResourceParser()
-        parser.feed(r.read().decode())
-        resource = unquote(parser.resource)
-        preview_url = json.loads(resource)["preview_url"]
+        if not valid_track_id(track_id):
+            return ControllerResponse(json.dumps({"error": "track_id is not a valid track id"}))
+        with METRICS.span("preview.resolve"):
+            preview_url = self.previews.resolve(track_id)
         return ControllerResponse(json.dumps({"preview_url": preview_url}))
 
+    @expose
+    @inject_header(('Content-Type', 'application/json'))
+    @validate(track_id=str)
+    def similar(self, request, track_id):
+        similarity = self.similarity_index()
+        catalog = similarity.catalog
+        track_ids = list(dict.fromkeys(value for value in track_id.split(",") if value))
+        if len(track_ids) > self.batch_limit:
+            return ControllerResponse(json.dumps(
+                {"similar": {}, "error": f"at most {self.batch_limit} track ids per request"}
+            ))
+        rows = [catalog.row_index(value) for value in track_ids]
+        neighbours = iter(similarity.similar_many([row for row in rows if row is not None], self.similar_count))
+        entries = [
+            b"%s: %s" % (
+                json.dumps(value).encode(),
+                b"null" if row is None else catalog.songs_json(next(neighbours)),
+            )
+            for value, row in zip(track_ids, rows)
+        ]
+        return ControllerResponse((b'{"similar": {%s}}' % b", ".join(entries)).decode())
+
+    @expose
+    @inject_header(('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'))
+    def metrics(self, request):
+        return ControllerResponse(METRICS.render())
+
 
 def get_args():
     parser = ArgumentParser()
     parser.add_argument("--data-dir", default="data/", required=False)
-    parser.add_argument("--songs-per-page", default=20, required=False)
-    parser.add_argument("--threads", default=20, required=False)
+    parser.add_argument("--songs-per-page", default=20, type=int, required=False)
+    parser.add_argument("--reload-interval", default=0, type=float, required=False)
+    parser.add_argument("--threads", default=20, type=int, required=False)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--host", default="127.0.0.1", required=False)
+    parser.add_argument("--port", default=8080, type=int, required=False)
+    parser.add_argument("--workers", default=0, type=int, required=False)
+    parser.add_argument("--catalog-file", default=None, required=False)
+    parser.add_argument("--cache-size", default=256, type=int, required=False)
+    parser.add_argument("--cache-ttl", default=300, type=float, required=False)
+    parser.add_argument("--cache-mb", default=256, type=int, required=False)
+    parser.add_argument("--profile-dir", default=None, required=False)
+    parser.add_argument("--profile-threshold", default=1.0, type=float, required=False)
+    parser.add_argument("--profile-interval", default=0.005, type=float, required=False)
+    parser.add_argument("--batch-limit", default=20, type=int, required=False)
+    parser.add_argument("--similar-count", default=10, type=int, required=False)
+    parser.add_argument("--search-cache-size", default=64, type=int, required=False)
+    parser.add_argument("--json-gzip-level", default=6, type=int, required=False)
+    parser.add_argument("--preview-url", default=SPOTIFY_URL, required=False)
+    parser.add_argument("--preview-cache", default="preview_cache.sqlite3", required=False)
+    parser.add_argument("--preview-ttl", default=7 * 24 * 3600, type=float, required=False)
+    parser.add_argument("--preview-cache-size", default=100000, type=int, required=False)
+    parser.add_argument("--preview-connections", default=4, type=int, required=False)
+    parser.add_argument("--prefetch", action="store_true")
+    parser.add_argument("--prefetch-workers", default=2, type=int, required=False)
+    parser.add_argument("--prefetch-queue", default=256, type=int, required=False)
+    parser.add_argument("--prefetch-rate", default=5.0, type=float, required=False)
     args, _ = parser.parse_known_args()
+    if args.workers and args.reload_interval:
+        parser.error("--reload-interval cannot be combined with --workers")
     return args
 
-def wsgi(options=None):
+def print_load_stats(data_dir, stats):
+    print(
+        f"Loaded {stats['rows']} songs from {stats['files']} files in {data_dir}, "
+        f"collapsed {stats['duplicates']} duplicate track ids"
+    )
+
+def load_data_dir(data_dir):
+    stats = {}
+    data = load_data(data_dir, stats)
+    print_load_stats(data_dir, stats)
+    return data
+
+def make_controller(options, data=None):
+    watcher = None
+    if options.reload_interval:
+        watcher = DataWatcher(options.data_dir, interval=options.reload_interval)
+        if data is None:
+            data, stats = watcher.load()
+            print_load_stats(options.data_dir, stats)
+    if data is None:
+        data = load_data_dir(options.data_dir)
+    previews = PreviewResolver(
+        base_url=options.preview_url,
+        store_path=options.preview_cache,
+        ttl=options.preview_ttl,
+        max_entries=options.preview_cache_size,
+        connections=options.preview_connections,
+    )
+    prefetcher = None
+    if options.prefetch:
+        prefetcher = PreviewPrefetcher(
+            previews,
+            workers=options.prefetch_workers,
+            queue_size=options.prefetch_queue,
+            rate=options.prefetch_rate,
+        )
+    controller = MusicController(
+        data,
+        songs_per_page=options.songs_per_page,
+        cache_size=options.cache_size,
+        cache_ttl=options.cache_ttl,
+        previews=previews,
+        prefetcher=prefetcher,
+        similar_count=options.similar_count,
+        batch_limit=options.batch_limit,
+        search_cache_size=options.search_cache_size,
+        cache_bytes=options.cache_mb * 1024 * 1024,
+    )
+    if watcher is not None:
+        watcher.on_change = controller.load
+        controller.watcher = watcher
+        watcher.start()
+    return controller
+
+def wsgi(options=None, controller=None):
     if options is None:
         options = get_args()
-    data = load_data(options.data_dir)
-    controller = MusicController(data, songs_per_page=options.songs_per_page)
+    if controller is None:
+        controller = make_controller(options)
     root = make_controller_root(controller, static_serve_dir="static/")
-    return root
+    if options.json_gzip_level:
+        root = CompressionMiddleware(root, {"/json"}, level=options.json_gzip_level)
+    root = AssetCache(
+        root,
+        ASSET_PATHS,
+        version=lambda: (controller.max_tempo, controller.max_time),
+    )
+    profiler = None
+    if options.profile_dir:
+        profiler = SamplingProfiler(
+            options.profile_dir, threshold=options.profile_threshold, interval=options.profile_interval
+        )
+    return MetricsMiddleware(root, threads=options.threads, profiler=profiler)
 
 def main():
     options = get_args()
+    if options.workers:
+        data = load_data_dir(options.data_dir)
+        catalog_file = options.catalog_file
+        temporary = False
+        if isinstance(data, Catalog) and catalog_file is None:
+            catalog_file = data.path
+        else:
+            if catalog_file is None:
+                fd, catalog_file = mkstemp(suffix=".catalog")
+                os.close(fd)
+                temporary = True
+            catalog = data if isinstance(data, Catalog) else Catalog(data.values())
+            catalog.save(catalog_file)
+            del catalog
+        del data
+        try:
+            serve_prefork(
+                lambda: wsgi(options, make_controller(options, Catalog.open(catalog_file))),
+                options.workers,
+                options.host,
+                options.port,
+            )
+        finally:
+            if temporary:
+                os.remove(catalog_file)
+        return
+    if options.use_async:
+        controller = make_controller(options)
+        app = AsyncApp(wsgi(options, controller), controller.previews, executor_workers=options.threads)
+        asyncio.run(serve_async(app, options.host, options.port))
+        return
     root = wsgi(options)
     wsgi_app = wrap_root(root, nThreads=options.threads)
     wsgi_app.serve()
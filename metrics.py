@@ -0,0 +1,228 @@
+from collections import Counter
+from contextlib import contextmanager
+import os
+import sys
+from threading import Event, get_ident, Lock, Thread
+from time import perf_counter, strftime
+
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+ROUTES = ("/", "/index", "/json", "/json_batch", "/preview_url", "/similar", "/metrics", "/css_src", "/js_src")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metrics:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = Lock()
+        self.descriptions = {}
+        self.counters = {}
+        self.histograms = {}
+        self.callbacks = {}
+
+    def describe(self, name, kind, help_text):
+        self.descriptions[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, tuple(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        key = (name, tuple(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def collect(self, name, callback, labels=()):
+        with self.lock:
+            self.callbacks[(name, tuple(labels))] = callback
+
+    def request(self, route, status, seconds):
+        self.observe("hacksprint_request_seconds", seconds, (("route", route),))
+        self.inc("hacksprint_requests_total", (("route", route), ("status", status)))
+
+    @contextmanager
+    def span(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("hacksprint_span_seconds", perf_counter() - start, (("span", name),))
+
+    def samples(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: ([*counts], total, count) for key, (counts, total, count) in self.histograms.items()}
+            callbacks = dict(self.callbacks)
+        samples = {}
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), callback in callbacks.items():
+            samples.setdefault(name, []).append((name, labels, callback()))
+        for (name, labels), (counts, total, count) in histograms.items():
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append((f"{name}_bucket", labels + (("le", format_value(bound)),), cumulative))
+            lines.append((f"{name}_bucket", labels + (("le", "+Inf"),), count))
+            lines.append((f"{name}_sum", labels, total))
+            lines.append((f"{name}_count", labels, count))
+        return samples
+
+    def render(self):
+        lines = []
+        for name, samples in sorted(self.samples().items()):
+            kind, help_text = self.descriptions.get(name, ("untyped", name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+METRICS.describe("hacksprint_span_seconds", "histogram", "Time spent in instrumented request stages.")
+METRICS.describe("hacksprint_request_seconds", "histogram", "Request latency by route.")
+METRICS.describe("hacksprint_requests_total", "counter", "Requests served by route and status.")
+METRICS.describe("hacksprint_requests_in_flight", "gauge", "Requests currently being handled.")
+METRICS.describe("hacksprint_worker_threads", "gauge", "Configured request worker threads.")
+METRICS.describe(
+    "hacksprint_saturated_requests_total", "counter",
+    "Requests that arrived while every worker thread was busy.",
+)
+METRICS.describe("hacksprint_query_cache_total", "counter", "Query result cache lookups by result.")
+METRICS.describe("hacksprint_preview_cache_total", "counter", "Preview URL cache lookups by result.")
+METRICS.describe("hacksprint_upstream_errors_total", "counter", "Failed preview URL lookups upstream.")
+METRICS.describe("hacksprint_slow_profiles_total", "counter", "Profiles written for slow requests.")
+
+
+class SamplingProfiler:
+
+    def __init__(self, directory, threshold=1.0, interval=0.005, metrics=METRICS):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self.metrics = metrics
+        self.active = {}
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        sampler = get_ident()
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is None or thread_id == sampler:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stacks[";".join(reversed(stack))] += 1
+            del frames
+
+    @contextmanager
+    def profile(self, name):
+        thread_id = get_ident()
+        stacks = Counter()
+        with self.lock:
+            self.active[thread_id] = stacks
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self.lock:
+                del self.active[thread_id]
+            if elapsed >= self.threshold and stacks:
+                self.dump(name, elapsed, stacks)
+
+    def dump(self, name, elapsed, stacks):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = name.strip("/").replace("/", "_") or "index"
+        path = os.path.join(
+            self.directory, f"{strftime('%Y%m%d-%H%M%S')}-{slug}-{int(elapsed * 1000)}ms-{get_ident()}.folded"
+        )
+        with open(path, "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        self.metrics.inc("hacksprint_slow_profiles_total")
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app, threads=None, profiler=None, metrics=METRICS):
+        self.app = app
+        self.threads = threads
+        self.profiler = profiler
+        self.metrics = metrics
+        self.in_flight = 0
+        self.lock = Lock()
+        metrics.collect("hacksprint_requests_in_flight", lambda: self.in_flight)
+        if threads:
+            metrics.collect("hacksprint_worker_threads", lambda: self.threads)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        route = path if path in ROUTES else "other"
+        status = []
+
+        def record_status(response_status, headers, exc_info=None):
+            status[:] = [response_status.split(" ", 1)[0]]
+            if exc_info is not None:
+                return start_response(response_status, headers, exc_info)
+            return start_response(response_status, headers)
+
+        with self.lock:
+            self.in_flight += 1
+            saturated = self.threads and self.in_flight >= self.threads
+        if saturated:
+            self.metrics.inc("hacksprint_saturated_requests_total")
+        start = perf_counter()
+        try:
+            if self.profiler is not None:
+                with self.profiler.profile(path):
+                    return self.app(environ, record_status)
+            return self.app(environ, record_status)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.metrics.request(route, status[0] if status else "500", perf_counter() - start)
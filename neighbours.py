@@ -0,0 +1,116 @@
+import heapq
+
+import numpy as np
+
+
+SIMILARITY_FIELDS = (
+    'dance',
+    'energy',
+    'happy',
+    'acoustic',
+    'instrumental',
+    'speech',
+    'live',
+    'tempo',
+    'time',
+)
+LEAF_SIZE = 128
+
+
+def feature_matrix(catalog):
+    return np.column_stack(
+        [catalog.normalized[field] for field in SIMILARITY_FIELDS]
+    ).astype(np.float32) / 100
+
+
+class KDTree:
+
+    def __init__(self, points, leaf_size=LEAF_SIZE):
+        order = np.arange(len(points))
+        starts, ends, lefts, rights, lows, highs = [], [], [], [], [], []
+        pending = [(0, len(points), None, None)]
+        while pending:
+            start, end, parent, side = pending.pop()
+            node = len(starts)
+            if parent is not None:
+                (lefts if side == 0 else rights)[parent] = node
+            rows = order[start:end]
+            box = points[rows]
+            low = box.min(axis=0) if len(box) else np.zeros(points.shape[1], dtype=points.dtype)
+            high = box.max(axis=0) if len(box) else low
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            lows.append(low)
+            highs.append(high)
+            if end - start <= leaf_size:
+                continue
+            dim = int(np.argmax(high - low))
+            if high[dim] == low[dim]:
+                continue
+            middle = (start + end) // 2
+            order[start:end] = rows[np.argpartition(box[:, dim], middle - start)]
+            pending.append((middle, end, node, 1))
+            pending.append((start, middle, node, 0))
+        self.order = order
+        self.points = points[order]
+        self.starts = np.array(starts)
+        self.ends = np.array(ends)
+        self.lefts = np.array(lefts)
+        self.rights = np.array(rights)
+        self.lows = np.array(lows).reshape(len(starts), points.shape[1])
+        self.highs = np.array(highs).reshape(len(starts), points.shape[1])
+
+    def box_distances(self, nodes, point):
+        below = np.maximum(self.lows[nodes] - point, 0)
+        above = np.maximum(point - self.highs[nodes], 0)
+        return ((below + above) ** 2).sum(axis=1)
+
+    def query(self, point, k, exclude=None):
+        found_distances = np.empty(0, dtype=self.points.dtype)
+        found_rows = np.empty(0, dtype=self.order.dtype)
+        if k <= 0 or not len(self.points):
+            return found_rows, found_distances
+        worst = np.inf
+        heap = [(0.0, 0)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if distance > worst:
+                break
+            if self.lefts[node] < 0:
+                start, end = self.starts[node], self.ends[node]
+                distances = ((self.points[start:end] - point) ** 2).sum(axis=1)
+                rows = self.order[start:end]
+                if exclude is not None:
+                    keep = rows != exclude
+                    distances, rows = distances[keep], rows[keep]
+                found_distances = np.concatenate((found_distances, distances))
+                found_rows = np.concatenate((found_rows, rows))
+                if len(found_rows) > k:
+                    nearest = np.lexsort((found_rows, found_distances))[:k]
+                    found_distances, found_rows = found_distances[nearest], found_rows[nearest]
+                if len(found_rows) == k:
+                    worst = found_distances.max()
+                continue
+            children = np.array((self.lefts[node], self.rights[node]))
+            for child, child_distance in zip(children.tolist(), self.box_distances(children, point).tolist()):
+                if child_distance <= worst:
+                    heapq.heappush(heap, (child_distance, child))
+        nearest = np.lexsort((found_rows, found_distances))
+        return found_rows[nearest], found_distances[nearest]
+
+
+class SimilarityIndex:
+
+    def __init__(self, catalog, leaf_size=LEAF_SIZE):
+        self.catalog = catalog
+        self.features = feature_matrix(catalog)
+        self.tree = KDTree(self.features, leaf_size=leaf_size)
+
+    def similar(self, row, k):
+        rows, _ = self.tree.query(self.features[row], k, exclude=row)
+        return rows
+
+    def similar_many(self, rows, k):
+        return [self.similar(row, k) for row in rows]
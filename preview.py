@@ -0,0 +1,519 @@
+import asyncio
+from codecs import getincrementaldecoder
+from concurrent.futures import Future
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+import json
+from queue import Empty, Full, LifoQueue, Queue
+import re
+import sqlite3
+import ssl
+from threading import BoundedSemaphore, Lock, Thread
+from time import monotonic, sleep, time
+from urllib.parse import quote, unquote, urlsplit
+
+from cache import LRUCache
+from metrics import METRICS
+
+
+SPOTIFY_URL = "https://open.spotify.com"
+EMBED_PATH = "/embed/track/{track_id}"
+TRACK_ID = re.compile(r"[A-Za-z0-9]{22}")
+CHUNK_SIZE = 16 * 1024
+DRAIN_LIMIT = 64 * 1024
+MISSING = object()
+JSON_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+JSON_STRING_VALUE = re.compile(r'\s*:\s*(null|"(?:[^"\\]|\\.)*")')
+
+
+class PreviewError(Exception):
+    pass
+
+
+def valid_track_id(track_id):
+    return TRACK_ID.fullmatch(track_id) is not None
+
+
+def embed_path(track_id):
+    return EMBED_PATH.format(track_id=quote(track_id, safe=""))
+
+
+class SpotifyResourceParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.resource = ""
+        self.chunks = []
+        self.tag_found = False
+        self.complete = False
+
+    def handle_starttag(self, tag, attrs):
+        dict_attrs = dict(attrs)
+        self.tag_found = tag == "script" and dict_attrs.get("id") == "resource"
+
+    def handle_data(self, data):
+        if self.tag_found:
+            self.chunks.append(data)
+
+    def handle_endtag(self, tag):
+        if self.tag_found and tag == "script":
+            self.tag_found = False
+            self.resource = "".join(self.chunks).strip()
+            self.complete = True
+
+
+def extract_preview_url(resource):
+    depth = 0
+    for match in JSON_TOKEN.finditer(resource):
+        token = match.group()
+        if token == "{" or token == "[":
+            depth += 1
+        elif token == "}" or token == "]":
+            depth -= 1
+        elif depth == 1 and token == '"preview_url"':
+            value = JSON_STRING_VALUE.match(resource, match.end())
+            if value is not None:
+                return json.loads(value.group(1))
+    raise PreviewError("No preview_url in resource")
+
+
+class ConnectionPool:
+
+    def __init__(self, base_url=SPOTIFY_URL, size=4, timeout=10):
+        parts = urlsplit(base_url)
+        self.connection_class = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        self.host = parts.netloc
+        self.timeout = timeout
+        self.idle = LifoQueue()
+        self.slots = BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            try:
+                connection = self.idle.get_nowait()
+            except Empty:
+                connection = self.connection_class(self.host, timeout=self.timeout)
+            try:
+                yield connection
+            except BaseException:
+                connection.close()
+                raise
+            self.idle.put(connection)
+
+    def request(self, connection, path):
+        reused = connection.sock is not None
+        try:
+            connection.request("GET", path)
+            return connection.getresponse()
+        except (ConnectionError, HTTPException):
+            if not reused:
+                raise
+        connection.close()
+        connection.request("GET", path)
+        return connection.getresponse()
+
+    @contextmanager
+    def get(self, path):
+        with self.connection() as connection:
+            response = self.request(connection, path)
+            try:
+                yield response
+            finally:
+                if not response.isclosed():
+                    if response.length is not None and response.length <= DRAIN_LIMIT:
+                        response.read()
+                    else:
+                        connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+
+
+class AsyncResponse:
+
+    def __init__(self, reader, writer, status, headers, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.timeout = timeout
+        self.chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+        length = headers.get("content-length")
+        self.remaining = int(length) if length is not None and not self.chunked else None
+        self.reusable = (
+            headers.get("connection", "").lower() != "close"
+            and (self.chunked or self.remaining is not None)
+        )
+        self.done = self.remaining == 0
+
+    async def read(self):
+        if self.done:
+            return b""
+        try:
+            chunk = await asyncio.wait_for(self.read_chunk(), self.timeout)
+        except (asyncio.IncompleteReadError, ValueError) as exc:
+            raise PreviewError(f"Malformed upstream response: {exc}") from exc
+        if not chunk:
+            self.done = True
+        return chunk
+
+    async def read_chunk(self):
+        reader = self.reader
+        if self.chunked:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if not size:
+                while await reader.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return b""
+            chunk = await reader.readexactly(size)
+            await reader.readline()
+            return chunk
+        if self.remaining is None:
+            return await reader.read(CHUNK_SIZE)
+        chunk = await reader.readexactly(min(CHUNK_SIZE, self.remaining))
+        self.remaining -= len(chunk)
+        self.done = not self.remaining
+        return chunk
+
+    async def drain(self):
+        drained = 0
+        while not self.done:
+            if drained > DRAIN_LIMIT or (self.remaining or 0) > DRAIN_LIMIT - drained:
+                return False
+            drained += len(await self.read())
+        return True
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncConnectionPool:
+
+    def __init__(self, base_url=SPOTIFY_URL, size=4, timeout=10):
+        parts = urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.netloc = parts.netloc
+        self.size = size
+        self.timeout = timeout
+        self.idle = []
+        self.loop = None
+
+    async def connect(self):
+        return await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host, self.port, ssl=ssl.create_default_context() if self.https else None
+            ),
+            self.timeout,
+        )
+
+    async def send(self, reader, writer, path):
+        writer.write(
+            f"GET {path} HTTP/1.1\r\nHost: {self.netloc}\r\n"
+            "Accept-Encoding: identity\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+        if not status_line:
+            raise ConnectionResetError("Upstream closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return AsyncResponse(reader, writer, status, headers, self.timeout)
+
+    async def get(self, path):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.idle = []
+        while self.idle:
+            reader, writer = self.idle.pop()
+            try:
+                return await self.send(reader, writer, path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+        reader, writer = await self.connect()
+        try:
+            return await self.send(reader, writer, path)
+        except BaseException:
+            writer.close()
+            raise
+
+    async def release(self, response):
+        try:
+            reusable = response.reusable and len(self.idle) < self.size and await response.drain()
+        except (PreviewError, OSError, asyncio.TimeoutError):
+            reusable = False
+        if reusable:
+            self.idle.append((response.reader, response.writer))
+        else:
+            response.close()
+
+    def close(self):
+        if self.loop is not None and not self.loop.is_closed():
+            for reader, writer in self.idle:
+                writer.close()
+        self.idle = []
+
+
+class PreviewStore:
+
+    def __init__(self, path, ttl=None, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.writes = 0
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS previews ("
+            "track_id TEXT PRIMARY KEY, preview_url TEXT, fetched_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS previews_fetched_at ON previews (fetched_at)")
+
+    def get(self, track_id):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT preview_url, fetched_at FROM previews WHERE track_id = ?", (track_id,)
+            ).fetchone()
+        if row is None:
+            return MISSING
+        preview_url, fetched_at = row
+        if self.ttl and fetched_at + self.ttl < time():
+            return MISSING
+        return preview_url
+
+    def set(self, track_id, preview_url):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO previews VALUES (?, ?, ?)", (track_id, preview_url, time())
+            )
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self.evict()
+
+    def evict(self):
+        if self.ttl:
+            self.db.execute("DELETE FROM previews WHERE fetched_at < ?", (time() - self.ttl,))
+        self.db.execute(
+            "DELETE FROM previews WHERE track_id IN "
+            "(SELECT track_id FROM previews ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class PreviewResolver:
+
+    def __init__(self, base_url=SPOTIFY_URL, store_path=":memory:", ttl=None,
+                 max_entries=100000, memory_entries=4096, connections=4):
+        self.timeout = 10
+        self.pool = ConnectionPool(base_url, size=connections, timeout=self.timeout)
+        self.async_pool = AsyncConnectionPool(base_url, size=connections, timeout=self.timeout)
+        self.store = PreviewStore(store_path, ttl=ttl, max_entries=max_entries)
+        self.memory = LRUCache(max_size=memory_entries, ttl=ttl)
+        self.pending = {}
+        self.async_pending = {}
+        self.lock = Lock()
+
+    def remembered(self, track_id):
+        return self.memory.get(track_id, MISSING) is not MISSING
+
+    def lookup(self, track_id):
+        preview_url = self.memory.get(track_id, MISSING)
+        if preview_url is MISSING:
+            preview_url = self.store.get(track_id)
+            if preview_url is not MISSING:
+                self.memory.set(track_id, preview_url)
+        return preview_url
+
+    def cached(self, track_id):
+        preview_url = self.lookup(track_id)
+        METRICS.inc("hacksprint_preview_cache_total", (("result", "miss" if preview_url is MISSING else "hit"),))
+        return preview_url
+
+    def remember(self, track_id, preview_url):
+        self.memory.set(track_id, preview_url)
+        self.store.set(track_id, preview_url)
+
+    def fetch(self, track_id):
+        path = embed_path(track_id)
+        parser = SpotifyResourceParser()
+        with self.pool.get(path) as response:
+            if response.status != 200:
+                raise PreviewError(f"{path}: HTTP {response.status}")
+            decoder = getincrementaldecoder("utf-8")(errors="replace")
+            while not parser.complete:
+                chunk = response.read(CHUNK_SIZE)
+                parser.feed(decoder.decode(chunk, final=not chunk))
+                if not chunk:
+                    break
+        if not parser.complete:
+            raise PreviewError(f"No resource found for track {track_id}")
+        return extract_preview_url(unquote(parser.resource))
+
+    def resolve(self, track_id):
+        preview_url = self.cached(track_id)
+        if preview_url is not MISSING:
+            return preview_url
+        return self.resolve_upstream(track_id)
+
+    def resolve_upstream(self, track_id):
+        with self.lock:
+            future = self.pending.get(track_id)
+            leader = future is None
+            if leader:
+                future = self.pending[track_id] = Future()
+        if not leader:
+            return future.result()
+        try:
+            with METRICS.span("preview.upstream"):
+                preview_url = self.fetch(track_id)
+            self.remember(track_id, preview_url)
+        except BaseException as exc:
+            METRICS.inc("hacksprint_upstream_errors_total")
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(preview_url)
+        finally:
+            with self.lock:
+                del self.pending[track_id]
+        return preview_url
+
+    async def fetch_async(self, track_id):
+        path = embed_path(track_id)
+        response = await self.async_pool.get(path)
+        parser = SpotifyResourceParser()
+        try:
+            if response.status != 200:
+                raise PreviewError(f"{path}: HTTP {response.status}")
+            decoder = getincrementaldecoder("utf-8")(errors="replace")
+            while not parser.complete:
+                chunk = await response.read()
+                parser.feed(decoder.decode(chunk, final=not chunk))
+                if not chunk:
+                    break
+        except BaseException:
+            response.close()
+            raise
+        await self.async_pool.release(response)
+        if not parser.complete:
+            raise PreviewError(f"No resource found for track {track_id}")
+        return extract_preview_url(unquote(parser.resource))
+
+    async def resolve_async(self, track_id):
+        loop = asyncio.get_running_loop()
+        future = self.async_pending.get(track_id)
+        if future is None:
+            preview_url = await loop.run_in_executor(None, self.cached, track_id)
+            if preview_url is not MISSING:
+                return preview_url
+            future = self.async_pending.get(track_id)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self.async_pending[track_id] = loop.create_future()
+        try:
+            with METRICS.span("preview.upstream"):
+                preview_url = await self.fetch_async(track_id)
+            await loop.run_in_executor(None, self.remember, track_id, preview_url)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            METRICS.inc("hacksprint_upstream_errors_total")
+            future.set_exception(exc)
+            future.exception()
+            raise
+        else:
+            future.set_result(preview_url)
+        finally:
+            del self.async_pending[track_id]
+        return preview_url
+
+    def close(self):
+        self.pool.close()
+        self.async_pool.close()
+        self.store.close()
+
+
+class RateLimiter:
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class PreviewPrefetcher:
+
+    def __init__(self, resolver, workers=2, queue_size=256, rate=5.0):
+        self.resolver = resolver
+        self.queue = Queue(maxsize=queue_size)
+        self.queued = set()
+        self.lock = Lock()
+        self.limiter = RateLimiter(rate, burst=workers) if rate else None
+        self.workers = [Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, track_ids):
+        for track_id in track_ids:
+            if self.resolver.remembered(track_id):
+                continue
+            with self.lock:
+                if track_id in self.queued:
+                    continue
+                try:
+                    self.queue.put_nowait(track_id)
+                except Full:
+                    return
+                self.queued.add(track_id)
+
+    def work(self):
+        while True:
+            track_id = self.queue.get()
+            if track_id is None:
+                return
+            try:
+                if self.resolver.lookup(track_id) is MISSING:
+                    if self.limiter is not None:
+                        self.limiter.acquire()
+                    self.resolver.resolve_upstream(track_id)
+            except Exception:
+                pass
+            finally:
+                with self.lock:
+                    self.queued.discard(track_id)
+
+    def close(self):
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
@@ -0,0 +1,253 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from io import BytesIO
+import json
+import os
+import signal
+from socketserver import ThreadingMixIn
+import sys
+from time import monotonic, perf_counter
+from traceback import print_exc
+from urllib.parse import parse_qs
+from wsgiref.simple_server import make_server, WSGIServer
+
+from assets import buffer_response
+from metrics import METRICS
+from preview import PreviewError, valid_track_id
+
+
+IDLE_TIMEOUT = 60
+READ_TIMEOUT = 30
+MAX_HEADERS = 100
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class AsyncApp:
+
+    def __init__(self, wsgi_app, previews, executor_workers=20):
+        self.wsgi_app = wsgi_app
+        self.previews = previews
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers)
+        self.routes = {
+            "/preview_url": self.preview_url,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        handler = self.routes.get(scope["path"])
+        if handler is not None:
+            start = perf_counter()
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            try:
+                status, headers, content = await handler(scope, body)
+            finally:
+                METRICS.request(scope["path"], str(int(status)), perf_counter() - start)
+        else:
+            loop = asyncio.get_running_loop()
+            status, headers, content = await loop.run_in_executor(
+                self.executor, self.call_wsgi, scope, body
+            )
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": content})
+
+    async def preview_url(self, scope, body):
+        query = parse_qs(scope["query_string"].decode("latin-1"))
+        track_id = query.get("track_id", [""])[0]
+        if not valid_track_id(track_id):
+            return self.json_response(HTTPStatus.OK, {"error": "track_id is not a valid track id"})
+        try:
+            with METRICS.span("preview.resolve"):
+                preview_url = await self.previews.resolve_async(track_id)
+        except (PreviewError, OSError, asyncio.TimeoutError) as exc:
+            return self.json_response(HTTPStatus.BAD_GATEWAY, {"error": str(exc)})
+        return self.json_response(HTTPStatus.OK, {"preview_url": preview_url})
+
+    def json_response(self, status, data):
+        return status, [(b"content-type", b"application/json")], json.dumps(data).encode()
+
+    def call_wsgi(self, scope, body):
+        server_name, server_port = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": "",
+            "PATH_INFO": scope["path"],
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": server_name,
+            "SERVER_PORT": str(server_port),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE":
+                environ[name] = value
+            elif name != "CONTENT_LENGTH":
+                environ[f"HTTP_{name}"] = value
+        status, headers, body = buffer_response(self.wsgi_app, environ)
+        headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers
+        ]
+        return int(status.split()[0]), headers, body
+
+
+async def handle_connection(app, reader, writer):
+    server = writer.get_extra_info("sockname")[:2]
+    client = writer.get_extra_info("peername")[:2]
+    try:
+        while True:
+            request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode("latin-1").split()
+            headers = []
+            while True:
+                line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                if len(headers) >= MAX_HEADERS:
+                    raise ValueError("Too many request headers")
+                name, _, value = line.decode("latin-1").partition(":")
+                headers.append((name.strip().lower().encode("latin-1"), value.strip().encode("latin-1")))
+            header_map = dict(headers)
+            length = int(header_map.get(b"content-length", b"0"))
+            if length < 0 or length > MAX_BODY_SIZE:
+                writer.write(
+                    b"HTTP/1.1 413 Content Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+                )
+                await writer.drain()
+                break
+            body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b""
+            path, _, query = target.partition("?")
+            scope = {
+                "type": "http",
+                "http_version": version.partition("/")[2],
+                "method": method,
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode("latin-1"),
+                "query_string": query.encode("latin-1"),
+                "headers": headers,
+                "server": server,
+                "client": client,
+            }
+            response = {}
+            chunks = []
+
+            async def receive():
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    response.update(message)
+                else:
+                    chunks.append(message.get("body", b""))
+
+            await app(scope, receive, send)
+            keep_alive = (
+                version == "HTTP/1.1"
+                and header_map.get(b"connection", b"").lower() != b"close"
+            )
+            content = b"".join(chunks)
+            status = HTTPStatus(response["status"])
+            head = [f"HTTP/1.1 {status.value} {status.phrase}"]
+            for name, value in response.get("headers", []):
+                if name.lower() not in (b"content-length", b"connection"):
+                    head.append(f"{name.decode('latin-1')}: {value.decode('latin-1')}")
+            head.append(f"Content-Length: {len(content)}")
+            head.append("Connection: keep-alive" if keep_alive else "Connection: close")
+            writer.write("\r\n".join(head).encode("latin-1") + b"\r\n\r\n" + content)
+            await asyncio.wait_for(writer.drain(), READ_TIMEOUT)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_async(app, host, port):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(app, reader, writer), host, port
+    )
+    async with server:
+        await server.serve_forever()
+
+
+MIN_WORKER_UPTIME = 5.0
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def serve_prefork(make_app, workers, host, port):
+    server = make_server(host, port, None, server_class=ThreadingWSGIServer)
+    children = {}
+
+    def spawn():
+        pid = os.fork()
+        if pid:
+            children[pid] = monotonic()
+            return
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        status = 0
+        try:
+            server.set_app(make_app())
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    failed = False
+    try:
+        for _ in range(workers):
+            spawn()
+        while children:
+            pid, status = os.wait()
+            uptime = monotonic() - children.pop(pid)
+            if status and uptime < MIN_WORKER_UPTIME:
+                print(
+                    f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)} "
+                    f"{uptime:.1f}s after starting, shutting down",
+                    file=sys.stderr,
+                )
+                failed = True
+                break
+            spawn()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        for pid in children:
+            os.waitpid(pid, 0)
+        server.server_close()
+    if failed:
+        sys.exit(1)
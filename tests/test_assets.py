@@ -0,0 +1,58 @@
+import gzip
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from assets import AssetCache, buffer_response, CompressionMiddleware, content_version, IMMUTABLE, REVALIDATE
+
+
+BODY = b"body { color: red; }" * 100
+
+
+def app(environ, start_response):
+    write = start_response("200 OK", [("Content-Type", "text/css"), ("Content-Length", str(len(BODY)))])
+    write(BODY[:10])
+    return [BODY[10:]]
+
+
+def request(wrapped, path, query="", **headers):
+    environ = {"PATH_INFO": path, "QUERY_STRING": query, **headers}
+    setup_testing_defaults(environ)
+    return buffer_response(wrapped, environ)
+
+
+def test_buffer_response_joins_written_and_returned_chunks():
+    status, headers, body = request(app, "/css_src")
+    assert status == "200 OK"
+    assert ("Content-Type", "text/css") in headers
+    assert body == BODY
+
+
+@pytest.mark.parametrize("query, cache_control", (
+    ("", REVALIDATE),
+    (f"v={content_version(BODY)}", IMMUTABLE),
+    ("v=stale", REVALIDATE),
+    (f"v=stale&v={content_version(BODY)}", REVALIDATE),
+))
+def test_only_the_current_version_is_immutable(query, cache_control):
+    cache = AssetCache(app, {"/css_src": "css_src", "/": "index"})
+    _, headers, body = request(cache, "/css_src", query)
+    assert dict(headers)["Cache-Control"] == cache_control
+    assert body == BODY
+    _, headers, _ = request(cache, "/", f"v={content_version(BODY)}")
+    assert dict(headers)["Cache-Control"] == REVALIDATE
+
+
+def test_matching_etag_answers_not_modified():
+    cache = AssetCache(app, {"/css_src": "css_src"})
+    _, headers, _ = request(cache, "/css_src", HTTP_ACCEPT_ENCODING="gzip")
+    status, _, body = request(cache, "/css_src", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=dict(headers)["ETag"])
+    assert (status, body) == ("304 Not Modified", b"")
+
+
+def test_compression_middleware_gzips_large_bodies():
+    status, headers, body = request(CompressionMiddleware(app, {"/json"}), "/json", HTTP_ACCEPT_ENCODING="gzip")
+    headers = dict(headers)
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Content-Length"] == str(len(body))
+    assert gzip.decompress(body) == BODY
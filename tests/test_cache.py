@@ -0,0 +1,51 @@
+from cache import LRUCache
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = LRUCache(max_size=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10.1
+    assert cache.get("a", "missing") == "missing"
+    assert len(cache) == 0
+
+
+def test_max_bytes_evicts_oldest_but_keeps_newest():
+    cache = LRUCache(max_size=10, max_bytes=100, weigh=len)
+    cache.set("a", "x" * 40)
+    cache.set("b", "x" * 40)
+    cache.set("c", "x" * 40)
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    cache.set("d", "x" * 500)
+    assert len(cache) == 1
+    assert cache.get("d") is not None
+
+
+def test_zero_size_disables_cache():
+    cache = LRUCache(max_size=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
@@ -0,0 +1,235 @@
+from collections import Counter
+import json
+import random
+import string
+
+import numpy as np
+import pytest
+
+from catalog import (
+    Catalog,
+    FACET_FIELDS,
+    FACET_LIMIT,
+    fold,
+    PAYLOAD_FIELDS,
+    QueryResult,
+    SEARCHABLE_FIELDS,
+    SORTABLE_FIELDS,
+    time_to_int,
+)
+
+
+WORDS = (
+    "love", "night", "dance", "fire", "blue", "moon", "the", "rock", "ss",
+    "Beyoncé", "Straße", "Strasse", "Ångström", "ﬁre", "é", "Motörhead",
+)
+SEARCHES = ("", "e", "lo", "love", "ss", "strasse", "beyonce", "night the", "é", "fire", "moon b", "xyz")
+WEIGHTS = (
+    {},
+    {"happy": 1.0},
+    {"tempo": -1.0},
+    {"time": 1.0, "dance": -1.0},
+    {"energy": 0.5, "live": -0.3, "popularity": 1.0},
+)
+PER_PAGE = 20
+FILTERS = (
+    ({"tempo": (90, 150)}, {}),
+    ({"time": (None, 150)}, {}),
+    ({"happy": (40, None), "dance": (None, 70)}, {}),
+    ({}, {"artist": "Love"}),
+    ({}, {"album": "fire moon"}),
+    ({}, {"artist": "Nobody"}),
+    ({"energy": (20, 80)}, {"artist": "Beyoncé"}),
+    ({"popularity": (101, None)}, {}),
+)
+
+
+def make_rows(count, seed=0):
+    rnd = random.Random(seed)
+    rows = []
+    for number in range(count):
+        row = {
+            "#": number + 1,
+            "song": " ".join(rnd.choices(WORDS, k=rnd.randint(1, 3))),
+            "artist": rnd.choice(WORDS).title(),
+            "album": " ".join(rnd.choices(WORDS, k=2)),
+            "time": f"{rnd.randint(1, 6)}:{rnd.randint(0, 59):02d}",
+            "spotify_track_id": "".join(rnd.choices(string.ascii_letters + string.digits, k=22)),
+        }
+        for field in SORTABLE_FIELDS:
+            if field != "time":
+                row[field] = rnd.randint(0, 200 if field == "tempo" else 100)
+        rows.append(row)
+    return rows
+
+
+def brute_force(rows, search, weights):
+    max_tempo = max(row["tempo"] for row in rows)
+    max_time = max(time_to_int(row["time"]) for row in rows)
+
+    def value(row, field):
+        if field == "tempo":
+            return row[field] * 100 // max_tempo
+        if field == "time":
+            return time_to_int(row[field]) * 100 // max_time
+        return row[field]
+
+    matches = [
+        index for index, row in enumerate(rows)
+        if any(search in fold(row[field]) for field in SEARCHABLE_FIELDS)
+    ]
+    if weights:
+        return sorted(
+            matches,
+            key=lambda index: -sum(value(rows[index], field) * factor for field, factor in weights.items()),
+        )
+    return sorted(matches, key=lambda index: (fold(rows[index]["song"]), rows[index]["song"].upper()))
+
+
+@pytest.fixture(scope="module")
+def rows():
+    return make_rows(2000)
+
+
+@pytest.fixture(scope="module", params=["memory", "mmap"])
+def catalog(request, rows, tmp_path_factory):
+    catalog = Catalog(rows)
+    if request.param == "mmap":
+        path = str(tmp_path_factory.mktemp("catalog") / "songs.catalog")
+        catalog.save(path)
+        catalog = Catalog.open(path)
+    return catalog
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+def test_search_matches_brute_force(rows, catalog, search):
+    expected = brute_force(rows, search, {})
+    assert sorted(catalog.search(search).tolist()) == sorted(expected)
+
+
+def brute_force_filter(rows, indices, ranges, facets):
+    def value(row, field):
+        return time_to_int(row[field]) if field == "time" else row[field]
+
+    return [
+        index for index in indices
+        if all(
+            (low is None or value(rows[index], field) >= low) and (high is None or value(rows[index], field) <= high)
+            for field, (low, high) in ranges.items()
+        )
+        and all(rows[index][field] == wanted for field, wanted in facets.items())
+    ]
+
+
+@pytest.mark.parametrize("ranges, facets", FILTERS)
+@pytest.mark.parametrize("search", ("", "e", "love", "xyz"))
+def test_filter_matches_brute_force(rows, catalog, search, ranges, facets):
+    expected = brute_force_filter(rows, brute_force(rows, search, {}), ranges, facets)
+    assert catalog.filter(catalog.search(search), ranges, facets).tolist() == sorted(expected)
+
+
+@pytest.mark.parametrize("search", ("", "e", "love", "xyz"))
+def test_facet_counts_match_brute_force(rows, catalog, search):
+    matches = catalog.search(search)
+    facets = catalog.facet_counts(matches)
+    for field in FACET_FIELDS:
+        counts = Counter(rows[index][field] for index in matches.tolist())
+        expected = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:FACET_LIMIT]
+        assert [tuple(facet) for facet in facets[field]] == expected
+
+
+def test_facet_code(rows, catalog):
+    for field in FACET_FIELDS:
+        values = sorted({row[field] for row in rows})
+        assert [catalog.facet_code(field, value) for value in values] == list(range(len(values)))
+        assert catalog.facet_code(field, "no such value") is None
+
+
+def test_search_within_narrows_previous_matches(catalog):
+    for shorter, longer in (("lov", "love"), ("nig", "night the"), ("str", "strasse")):
+        narrowed = catalog.search(longer, catalog.search(shorter))
+        assert narrowed.tolist() == catalog.search(longer).tolist()
+
+
+@pytest.mark.parametrize("weights", WEIGHTS)
+@pytest.mark.parametrize("search", SEARCHES)
+def test_order_matches_brute_force(rows, catalog, search, weights):
+    expected = brute_force(rows, search, weights)
+    matches = catalog.search(search)
+    assert catalog.order(matches, weights).tolist() == expected
+    for limit in (1, PER_PAGE, 3 * PER_PAGE, len(expected) + 1):
+        assert catalog.order(matches, weights, limit=limit).tolist() == expected[:limit]
+
+
+@pytest.mark.parametrize("weights", WEIGHTS)
+@pytest.mark.parametrize("search", SEARCHES)
+def test_pages_match_brute_force(rows, catalog, search, weights):
+    expected = brute_force(rows, search, weights)
+    result = QueryResult(catalog, catalog.search(search), weights)
+    pages = [1, 2, 5, 2, 40, 1]
+    for page in pages:
+        start = (page - 1) * PER_PAGE
+        assert result.slice(start, start + PER_PAGE).tolist() == expected[start:start + PER_PAGE]
+
+
+@pytest.mark.parametrize("cached", [True, False])
+@pytest.mark.parametrize("weights", WEIGHTS)
+@pytest.mark.parametrize("search", SEARCHES)
+def test_cursor_walk_matches_brute_force(rows, catalog, search, weights, cached):
+    expected = brute_force(rows, search, weights)
+    result = QueryResult(catalog, catalog.search(search), weights)
+    songs = result.slice(0, PER_PAGE)
+    walked = []
+    while len(songs):
+        assert len(songs) <= PER_PAGE
+        walked.extend(songs.tolist())
+        position = len(walked)
+        if position >= len(expected):
+            break
+        keys, _ = catalog.sort_keys(songs[-1:], weights)
+        if not cached:
+            result = QueryResult(catalog, catalog.search(search), weights)
+        resumed, songs = result.resume(position, float(keys[0]), catalog.track_ids[songs[-1]], PER_PAGE)
+        assert resumed == position
+    assert walked == expected
+
+
+def test_page_json_matches_rows(rows, catalog):
+    indices = catalog.search("love")[:PER_PAGE]
+    page = json.loads(catalog.page_json(indices, 2, 7, cursor="abc", facets={"artist": []}))
+    assert page["songs"] == [{field: rows[index][field] for field in PAYLOAD_FIELDS} for index in indices.tolist()]
+    assert (page["page"], page["max_page"], page["cursor"], page["facets"]) == (2, 7, "abc", {"artist": []})
+
+
+def test_page_json_compact_sends_known_tracks_as_ids(rows, catalog):
+    indices = catalog.search("love")[:PER_PAGE]
+    known = {rows[index]["spotify_track_id"] for index in indices.tolist()[::2]}
+    page = json.loads(catalog.page_json_compact(indices, 1, 3, known=known))
+    assert page["fields"] == list(PAYLOAD_FIELDS)
+    assert (page["page"], page["max_page"], page["cursor"], page["facets"]) == (1, 3, None, None)
+    assert len(page["rows"]) == len(indices)
+    for index, entry in zip(indices.tolist(), page["rows"]):
+        track_id = rows[index]["spotify_track_id"]
+        if track_id in known:
+            assert entry == track_id
+        else:
+            assert entry == [rows[index][field] for field in PAYLOAD_FIELDS]
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+def test_search_returns_int32_rows(catalog, search):
+    assert catalog.search(search).dtype == np.int32
+
+
+def test_empty_search_shares_all_rows(catalog):
+    rows = catalog.search("")
+    assert rows is catalog.search("")
+    assert not rows.flags.writeable
+    assert np.array_equal(rows, np.arange(catalog.size))
+
+
+def test_empty_catalog():
+    catalog = Catalog([])
+    assert len(catalog.search("")) == 0
+    assert len(catalog.search("love")) == 0
+    assert len(catalog.order(catalog.search(""), {"happy": 1.0}, limit=PER_PAGE)) == 0
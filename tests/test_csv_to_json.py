@@ -0,0 +1,93 @@
+import csv
+import json
+
+import pytest
+
+from catalog import Catalog
+from csv_to_json import convert, convert_all, merge_all, write_json
+from data_dir import load_data
+
+
+HEADER = (
+    "#", "Song", "Artist", "Album", "Time", "Popularity", "Dance", "Energy", "Acoustic",
+    "Instrumental", "Happy", "Speech", "Live", "Tempo", "Spotify Track Id",
+)
+
+
+def write_csv(path, track_ids, bad_rows=0):
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(HEADER)
+        for number, track_id in enumerate(track_ids):
+            writer.writerow((
+                f" {number} ", f" Song {track_id} ", "Artist", "Album", f"3:{number % 60:02d}",
+                number % 100, 1, 2, 3, 4, 5, 6, 7, 90 + number % 50, track_id,
+            ))
+        for _ in range(bad_rows):
+            writer.writerow(("x", "Bad", "Artist", "Album", "3:00", "high", 1, 2, 3, 4, 5, 6, 7, 90, "bad"))
+
+
+def test_merge_all_writes_one_catalog(tmp_path):
+    write_csv(tmp_path / "a.csv", [f"a{number}" for number in range(30)], bad_rows=2)
+    write_csv(tmp_path / "b.csv", [f"a{number}" for number in range(20, 50)])
+    output = str(tmp_path / "songs.catalog")
+    results = {stats["path"]: stats for stats in merge_all([str(tmp_path)], output, processes=1)}
+    assert results[str(tmp_path / "a.csv")]["rows"] == 30
+    assert results[str(tmp_path / "a.csv")]["rejected"] == 2
+    assert results[output]["rows"] == 50
+    stats = {}
+    catalog = load_data(str(tmp_path), stats)
+    assert isinstance(catalog, Catalog)
+    assert catalog.size == 50
+    assert stats["files"] == 1
+    assert sorted(row["spotify_track_id"] for row in catalog.rows()) == sorted(f"a{number}" for number in range(50))
+
+
+def test_convert_streams_rows_and_counts_rejects(tmp_path):
+    path = str(tmp_path / "songs.csv")
+    write_csv(path, [f"t{number}" for number in range(25)], bad_rows=3)
+    stats = convert(path)
+    assert (stats["rows"], stats["rejected"]) == (25, 3)
+    with open(path + ".json") as json_file:
+        rows = json.load(json_file)
+    assert [row["spotify_track_id"] for row in rows] == [f"t{number}" for number in range(25)]
+    assert rows[0]["song"] == "Song t0"
+    assert (rows[0]["#"], rows[0]["tempo"]) == (0, 90)
+    assert not (tmp_path / "songs.csv.json.tmp").exists()
+
+
+@pytest.mark.parametrize("rows", ([], [{"a": 1}], [{"a": 1, "b": [2, "x"]}, {"a": "\n"}]))
+def test_write_json_matches_json_dump(tmp_path, rows):
+    path = str(tmp_path / "rows.json")
+    write_json(iter(rows), path)
+    with open(path) as json_file:
+        assert json.load(json_file) == rows
+
+
+def test_write_json_failure_keeps_previous_output(tmp_path):
+    path = str(tmp_path / "rows.json")
+    write_json([{"a": 1}], path)
+
+    def rows():
+        yield {"a": 2}
+        raise ValueError("broken row")
+
+    with pytest.raises(ValueError, match="broken row"):
+        write_json(rows(), path)
+    with open(path) as json_file:
+        assert json.load(json_file) == [{"a": 1}]
+    assert not (tmp_path / "rows.json.tmp").exists()
+
+
+def test_write_json_reports_open_errors(tmp_path):
+    with pytest.raises(FileNotFoundError) as excinfo:
+        write_json([], str(tmp_path / "missing" / "rows.json"))
+    assert excinfo.value.__context__ is None
+
+
+def test_convert_all_reports_failed_files(tmp_path):
+    write_csv(tmp_path / "good.csv", ["t1", "t2"], bad_rows=1)
+    missing = str(tmp_path / "missing.csv")
+    results = {stats["path"]: stats for stats in convert_all([str(tmp_path / "good.csv"), missing], processes=1)}
+    assert (results[str(tmp_path / "good.csv")]["rows"], results[str(tmp_path / "good.csv")]["rejected"]) == (2, 1)
+    assert results[missing]["error"].startswith("FileNotFoundError")
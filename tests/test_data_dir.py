@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+from catalog import Catalog, PAYLOAD_FIELDS, SongRecord
+from data_dir import DataWatcher, load_data
+
+
+def song(track_id, title="Song"):
+    return {
+        "song": title, "artist": "Artist", "album": "Album", "time": "3:00",
+        "popularity": 1, "dance": 2, "energy": 3, "happy": 4, "acoustic": 5,
+        "instrumental": 6, "speech": 7, "live": 8, "tempo": 90,
+        "spotify_track_id": track_id,
+    }
+
+
+def write_json(path, songs):
+    with open(path, "w") as f:
+        json.dump(songs, f)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    write_json(tmp_path / "a.json", [song(f"a{number}") for number in range(10)])
+    write_json(tmp_path / "b.json", [song(f"b{number}") for number in range(10)])
+    watcher = DataWatcher(str(tmp_path))
+    yield watcher
+    watcher.stop()
+
+
+def test_watcher_rebuilds_only_after_changes(tmp_path, watcher):
+    catalog, stats = watcher.load()
+    assert catalog.size == 20
+    assert (stats["files"], stats["parsed"]) == (2, 2)
+    changes = []
+    watcher.on_change = changes.append
+    assert not watcher.scan()
+    write_json(tmp_path / "b.json", [song(f"b{number}", "New") for number in range(5)] + [song("a0")])
+    assert watcher.scan()
+    catalog, = changes
+    assert isinstance(catalog, Catalog)
+    assert catalog.size == 15
+    assert catalog.path == watcher.catalog_path
+    assert not watcher.scan()
+
+
+def test_watcher_reparses_only_changed_files(tmp_path, watcher):
+    watcher.load()
+    write_json(tmp_path / "c.json", [song("c0")])
+    catalog, stats = watcher.load()
+    assert catalog.size == 21
+    assert (stats["files"], stats["parsed"]) == (3, 1)
+    os.remove(tmp_path / "a.json")
+    catalog, stats = watcher.load()
+    assert catalog.size == 11
+    assert (stats["files"], stats["parsed"]) == (2, 0)
+
+
+def test_watcher_keeps_last_good_version_of_broken_files(tmp_path, watcher):
+    watcher.load()
+    with open(tmp_path / "a.json", "w") as f:
+        f.write("[{")
+    catalog, stats = watcher.load()
+    assert catalog.size == 20
+    assert stats["parsed"] == 0
+
+
+def test_load_data_merges_files_and_counts_duplicates(tmp_path):
+    write_json(tmp_path / "a.json", [song("a0"), song("a1"), song("a0", "Again")])
+    write_json(tmp_path / "b.json", [song("b0"), song("a1", "Newer")])
+    Catalog([song("c0"), song("b0", "Older")]).save(str(tmp_path / "c.catalog"))
+    stats = {}
+    data = load_data(str(tmp_path), stats)
+    assert stats == {"files": 3, "rows": 7, "duplicates": 3}
+    assert sorted(data) == ["a0", "a1", "b0", "c0"]
+    assert [data[track_id].song for track_id in ("a0", "a1", "b0")] == ["Again", "Newer", "Song"]
+    catalog = Catalog(data.values())
+    assert catalog.size == 4
+    assert sorted(row["spotify_track_id"] for row in catalog.rows()) == sorted(data)
+
+
+def test_single_catalog_is_opened_directly(tmp_path):
+    Catalog([song("c0"), song("c1")]).save(str(tmp_path / "c.catalog"))
+    stats = {}
+    catalog = load_data(str(tmp_path), stats)
+    assert isinstance(catalog, Catalog)
+    assert stats == {"files": 1, "rows": 2, "duplicates": 0}
+
+
+def test_song_record_is_a_plain_tuple():
+    record = SongRecord.from_row(dict(song("t0"), extra="ignored"))
+    assert record._fields == PAYLOAD_FIELDS
+    assert record[0] == record.song == "Song"
+    assert record[-1] == record.spotify_track_id == "t0"
+    assert list(record) == [song("t0")[field] for field in PAYLOAD_FIELDS]
+    assert record._asdict() == song("t0")
@@ -0,0 +1,68 @@
+from io import BytesIO
+import json
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+pytest.importorskip("pyttp")
+
+from pyttp.scaffold import make_controller_root
+
+from assets import buffer_response
+from benchmark import synthetic_data
+from main import BATCH_DEFAULTS, MusicController
+
+
+QUERIES = (
+    {"search": "love"},
+    {"search": "love", "page": 2},
+    {"search": "", "happy": 1, "tempo_min": 100},
+    {"search": "night", "energy": -1, "artist": None},
+    {},
+)
+
+
+@pytest.fixture(scope="module")
+def app():
+    controller = MusicController(synthetic_data(500), songs_per_page=20, batch_limit=5)
+    return make_controller_root(controller, static_serve_dir="static/")
+
+
+def post(app, path, form):
+    body = urlencode(form).encode()
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": path,
+        "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    status, _, body = buffer_response(app, environ)
+    assert status.startswith("200")
+    return json.loads(body)
+
+
+def test_json_batch_matches_single_queries(app):
+    batch = post(app, "/json_batch", {"queries": json.dumps(QUERIES)})
+    expected = [
+        post(app, "/json", {
+            **BATCH_DEFAULTS,
+            **{name: str(value) for name, value in query.items() if value is not None},
+        })
+        for query in QUERIES
+    ]
+    assert batch["results"] == expected
+    assert [page["page"] for page in batch["results"]] == [1, 2, 1, 1, 1]
+
+
+@pytest.mark.parametrize("queries", ("{}", "[1, 2]", "not json", json.dumps([{}] * 6)))
+def test_json_batch_rejects_bad_queries(app, queries):
+    batch = post(app, "/json_batch", {"queries": queries})
+    assert batch["results"] == []
+    assert batch["error"]
+
+
+def test_json_batch_without_queries(app):
+    assert post(app, "/json_batch", {}) == {"results": []}
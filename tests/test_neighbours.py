@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from neighbours import KDTree
+
+
+def brute_force(points, point, k, exclude=None):
+    distances = ((points - point) ** 2).sum(axis=1)
+    rows = np.arange(len(points))
+    if exclude is not None:
+        distances, rows = distances[rows != exclude], rows[rows != exclude]
+    nearest = np.lexsort((rows, distances))[:k]
+    return rows[nearest].tolist(), distances[nearest].tolist()
+
+
+@pytest.mark.parametrize("levels", (3, 11, None))
+@pytest.mark.parametrize("leaf_size", (1, 4, 32))
+def test_query_matches_brute_force(levels, leaf_size):
+    rnd = np.random.default_rng(levels or 0)
+    if levels is None:
+        points = rnd.random((500, 9), dtype=np.float32)
+    else:
+        points = (rnd.integers(0, levels, (500, 9)) / (levels - 1)).astype(np.float32)
+    tree = KDTree(points, leaf_size=leaf_size)
+    for row in range(0, len(points), 7):
+        for k in (1, 5, 40):
+            rows, distances = tree.query(points[row], k, exclude=row)
+            assert (rows.tolist(), distances.tolist()) == brute_force(points, points[row], k, exclude=row)
+        rows, distances = tree.query(points[row], 10)
+        assert (rows.tolist(), distances.tolist()) == brute_force(points, points[row], 10)
+
+
+def test_query_with_identical_points():
+    points = np.zeros((50, 3), dtype=np.float32)
+    rows, distances = KDTree(points, leaf_size=4).query(points[0], 5, exclude=3)
+    assert rows.tolist() == [0, 1, 2, 4, 5]
+    assert distances.tolist() == [0.0] * 5
+
+
+def test_query_more_than_available():
+    points = np.eye(3, dtype=np.float32)
+    rows, _ = KDTree(points).query(points[0], 10, exclude=0)
+    assert rows.tolist() == [1, 2]
+    assert KDTree(points).query(points[0], 0)[0].tolist() == []
@@ -0,0 +1,182 @@
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Thread
+from time import sleep
+from urllib.parse import quote
+
+import pytest
+
+from preview import (
+    embed_path,
+    PreviewError,
+    PreviewPrefetcher,
+    PreviewResolver,
+    valid_track_id,
+)
+
+
+TRACK_ID = "4uLU6hMCjMI75M1A2tKUQC"
+OTHER_TRACK_ID = "7GhIk7Il098yCjg4BQjzvb"
+
+
+class EmbedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        sleep(self.server.delay)
+        track_id = self.path.rsplit("/", 1)[-1]
+        if track_id == "missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        resource = quote(json.dumps({"name": track_id, "preview_url": f"https://p.scdn.co/{track_id}.mp3"}))
+        body = (
+            "<html><body>" + "<div>padding</div>" * 500
+            + f'<script id="resource" type="application/json">{resource}</script>'
+            + "<div>tail</div>" * 500 + "</body></html>"
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        if self.server.chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(body), 4096):
+                chunk = body[start:start + 4096]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EmbedHandler)
+    server.paths = []
+    server.connections = 0
+    server.delay = 0.0
+    server.chunked = False
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_track_id_validation():
+    assert valid_track_id(TRACK_ID)
+    assert not valid_track_id("")
+    assert not valid_track_id(TRACK_ID[:-1])
+    assert not valid_track_id(TRACK_ID + "\r\nHost: x")
+    assert not valid_track_id("../../" + TRACK_ID[6:])
+    assert embed_path("a b/../\r\n") == "/embed/track/a%20b%2F..%2F%0D%0A"
+
+
+def test_resolve_caches(upstream):
+    resolver = PreviewResolver(base_url=upstream.url)
+    assert resolver.resolve(TRACK_ID) == f"https://p.scdn.co/{TRACK_ID}.mp3"
+    assert resolver.resolve(TRACK_ID) == f"https://p.scdn.co/{TRACK_ID}.mp3"
+    assert upstream.paths == [f"/embed/track/{TRACK_ID}"]
+    resolver.close()
+
+
+def test_resolve_persists_across_restarts(upstream, tmp_path):
+    store_path = str(tmp_path / "previews.sqlite3")
+    resolver = PreviewResolver(base_url=upstream.url, store_path=store_path)
+    resolver.resolve(TRACK_ID)
+    resolver.close()
+    resolver = PreviewResolver(base_url=upstream.url, store_path=store_path)
+    assert resolver.resolve(TRACK_ID) == f"https://p.scdn.co/{TRACK_ID}.mp3"
+    assert len(upstream.paths) == 1
+    resolver.close()
+
+
+def test_resolve_expires_after_ttl(upstream):
+    resolver = PreviewResolver(base_url=upstream.url, ttl=0.05)
+    resolver.resolve(TRACK_ID)
+    sleep(0.1)
+    resolver.resolve(TRACK_ID)
+    assert len(upstream.paths) == 2
+    resolver.close()
+
+
+def test_upstream_errors_are_not_cached(upstream):
+    resolver = PreviewResolver(base_url=upstream.url)
+    for _ in range(2):
+        with pytest.raises(PreviewError):
+            resolver.resolve("missing")
+    assert len(upstream.paths) == 2
+    resolver.close()
+
+
+def test_concurrent_resolves_coalesce(upstream):
+    upstream.delay = 0.2
+    resolver = PreviewResolver(base_url=upstream.url)
+    results = []
+    threads = [
+        Thread(target=lambda track_id=track_id: results.append(resolver.resolve(track_id)))
+        for track_id in [TRACK_ID] * 8 + [OTHER_TRACK_ID] * 8
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(upstream.paths) == sorted([f"/embed/track/{TRACK_ID}", f"/embed/track/{OTHER_TRACK_ID}"])
+    assert results.count(f"https://p.scdn.co/{TRACK_ID}.mp3") == 8
+    resolver.close()
+
+
+def test_concurrent_async_resolves_coalesce(upstream):
+    upstream.delay = 0.2
+    resolver = PreviewResolver(base_url=upstream.url)
+
+    async def resolve_all():
+        return await asyncio.gather(*(resolver.resolve_async(TRACK_ID) for _ in range(8)))
+
+    assert asyncio.run(resolve_all()) == [f"https://p.scdn.co/{TRACK_ID}.mp3"] * 8
+    assert asyncio.run(resolve_all()) == [f"https://p.scdn.co/{TRACK_ID}.mp3"] * 8
+    assert upstream.paths == [f"/embed/track/{TRACK_ID}"]
+    resolver.close()
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_async_lookups_reuse_connections(upstream, chunked):
+    upstream.chunked = chunked
+    resolver = PreviewResolver(base_url=upstream.url)
+    track_ids = [TRACK_ID, OTHER_TRACK_ID, "0" * 22]
+
+    async def resolve_all():
+        return [await resolver.resolve_async(track_id) for track_id in track_ids]
+
+    assert asyncio.run(resolve_all()) == [f"https://p.scdn.co/{track_id}.mp3" for track_id in track_ids]
+    assert len(upstream.paths) == 3
+    assert upstream.connections == 1
+    resolver.close()
+
+
+def test_prefetcher_fills_the_cache(upstream):
+    resolver = PreviewResolver(base_url=upstream.url)
+    prefetcher = PreviewPrefetcher(resolver, workers=2, rate=None)
+    prefetcher.submit([TRACK_ID, OTHER_TRACK_ID, TRACK_ID])
+    for _ in range(100):
+        if not prefetcher.queued and prefetcher.queue.empty():
+            break
+        sleep(0.02)
+    prefetcher.close()
+    assert resolver.lookup(TRACK_ID) == f"https://p.scdn.co/{TRACK_ID}.mp3"
+    assert resolver.lookup(OTHER_TRACK_ID) == f"https://p.scdn.co/{OTHER_TRACK_ID}.mp3"
+    assert len(upstream.paths) == 2
+    resolver.close()
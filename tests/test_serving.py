@@ -0,0 +1,79 @@
+import asyncio
+import socket
+from threading import Thread
+from time import monotonic, sleep
+
+import pytest
+
+from metrics import METRICS
+import serving
+from serving import AsyncApp, serve_async
+
+
+def echo_app(environ, start_response):
+    body = environ["wsgi.input"].read()
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"%s %s" % (environ["PATH_INFO"].encode(), body)]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(serving, "IDLE_TIMEOUT", 0.3)
+    monkeypatch.setattr(serving, "READ_TIMEOUT", 0.3)
+    monkeypatch.setattr(serving, "MAX_BODY_SIZE", 1000)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    app = AsyncApp(echo_app, previews=None, executor_workers=2)
+    Thread(target=lambda: asyncio.run(serve_async(app, "127.0.0.1", port)), daemon=True).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except ConnectionRefusedError:
+            sleep(0.02)
+    return port
+
+
+def request(port, data, wait=2.0):
+    with socket.create_connection(("127.0.0.1", port), timeout=wait) as connection:
+        connection.sendall(data)
+        chunks = []
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+
+def test_serves_keep_alive_requests(server):
+    response = request(server, b"POST /echo HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello" * 2)
+    assert response.count(b"HTTP/1.1 200 OK") == 2
+    assert b"/echo hello" in response
+
+
+def test_idle_connections_are_closed(server):
+    start = monotonic()
+    assert request(server, b"") == b""
+    assert monotonic() - start < 1.5
+
+
+def test_stalled_bodies_are_dropped(server):
+    start = monotonic()
+    assert request(server, b"POST /echo HTTP/1.1\r\nContent-Length: 10\r\n\r\nhel") == b""
+    assert monotonic() - start < 1.5
+
+
+def test_oversized_bodies_are_rejected(server):
+    response = request(server, b"POST /echo HTTP/1.1\r\nContent-Length: 5000\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 413")
+
+
+def test_direct_routes_record_request_metrics(server):
+    key = ("hacksprint_requests_total", (("route", "/preview_url"), ("status", "200")))
+    before = METRICS.counters.get(key, 0)
+    response = request(server, b"GET /preview_url?track_id=bad HTTP/1.1\r\nConnection: close\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 200")
+    assert b"not a valid track id" in response
+    assert METRICS.counters[key] == before + 1
+    assert METRICS.histograms[("hacksprint_request_seconds", (("route", "/preview_url"),))][2] >= 1